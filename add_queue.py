@@ -0,0 +1,222 @@
+import itertools
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Statuses after which an item leaves the queue
+FINAL_STATUSES = ('added', 'exists', 'failed')
+
+
+class TransientAddError(Exception):
+    """Radarr/Sonarr could not take the request right now; worth retrying"""
+
+
+class ArrAdder:
+    """Sends add payloads to one Radarr/Sonarr instance.
+
+    bulk() uses the instance's import endpoint, which takes a whole list in
+    one request; single() adds one title through the regular endpoint.
+    """
+
+    def __init__(self, name, session, base_url, resource, exists_marker):
+        self.name = name
+        self.session = session
+        self.base_url = base_url
+        self.resource = resource
+        self.exists_marker = exists_marker
+
+    def _post(self, url, json):
+        try:
+            r = self.session.post(url, json=json)
+        except requests.RequestException as e:
+            raise TransientAddError(str(e))
+        if r.status_code == 429 or r.status_code >= 500:
+            raise TransientAddError(f"{self.name} returned status {r.status_code}")
+        return r
+
+    def bulk(self, payloads):
+        """Add all payloads in one request. Returns False if the batch was rejected."""
+        r = self._post(f"{self.base_url}/api/v3/{self.resource}/import", payloads)
+        return r.ok
+
+    def single(self, payload):
+        """Add one title. Returns 'added' or 'exists'; raises ValueError if rejected."""
+        r = self._post(f"{self.base_url}/api/v3/{self.resource}", payload)
+        if r.ok:
+            return 'added'
+        if self.exists_marker in r.text:
+            return 'exists'
+        raise ValueError(f"{self.name} returned status {r.status_code}: {r.text[:200]}")
+
+
+class AddQueue:
+    """Background queue that submits confirmed titles to Radarr/Sonarr in batches.
+
+    Items queued within batch_wait seconds of each other are sent together
+    through the bulk import endpoint. If a batch is rejected, its items are
+    retried one by one with at most `workers` requests in flight so each gets
+    its own outcome. Transient failures (network errors, 429, 5xx) are retried
+    with exponential backoff up to max_attempts. Every item has a status
+    record that can be polled by id; listener, if given, is called with the
+    record whenever an item reaches a final status.
+    """
+
+    def __init__(self, adders, batch_size=20, batch_wait=2.0, workers=4,
+                 max_attempts=4, backoff=5.0, history=500, listener=None):
+        self.adders = adders
+        self.listener = listener
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.history = history
+        self.pending = queue.Queue()
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.items = OrderedDict()  # id -> status record, oldest first
+        self.payloads = {}
+        self.outstanding = 0
+        self.ids = itertools.count(1)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    # ---------- public ----------
+
+    def put(self, kind, payload):
+        """Queue a title for adding and return its status record"""
+        with self.lock:
+            item_id = str(next(self.ids))
+            record = {
+                'id': item_id,
+                'type': kind,
+                'title': payload.get('title'),
+                'status': 'queued',
+                'attempts': 0,
+                'error': None,
+            }
+            self.items[item_id] = record
+            self.payloads[item_id] = payload
+            self.outstanding += 1
+            self._trim()
+            snapshot = dict(record)
+        self.pending.put(item_id)
+        return snapshot
+
+    def status(self, item_id):
+        with self.lock:
+            record = self.items.get(item_id)
+            return dict(record) if record else None
+
+    def snapshot(self):
+        """Status records, newest first"""
+        with self.lock:
+            return [dict(record) for record in reversed(self.items.values())]
+
+    def wait(self, timeout=None):
+        """Block until every queued item has a final status. Returns False on timeout."""
+        with self.idle:
+            return self.idle.wait_for(lambda: self.outstanding == 0, timeout)
+
+    def unfinished(self):
+        """Status records of items that have not reached a final status yet"""
+        with self.lock:
+            return [dict(record) for record in self.items.values() if record['status'] not in FINAL_STATUSES]
+
+    # ---------- internals ----------
+
+    def _trim(self):
+        # Forget the oldest finished items beyond the history limit
+        excess = len(self.items) - self.history
+        for item_id in list(self.items):
+            if excess <= 0:
+                break
+            if self.items[item_id]['status'] in FINAL_STATUSES:
+                del self.items[item_id]
+                excess -= 1
+
+    def _set(self, item_id, status, error=None):
+        with self.lock:
+            record = self.items.get(item_id)
+            if record is not None:
+                record['status'] = status
+                record['error'] = error
+                title = record['title']
+                snapshot = dict(record)
+            if status in FINAL_STATUSES:
+                self.payloads.pop(item_id, None)
+                self.outstanding -= 1
+                self.idle.notify_all()
+        if record is not None and status in FINAL_STATUSES:
+            target = self.adders[record['type']].name
+            if status == 'failed':
+                print(f"Failed to add to {target}: {title} ({error})")
+            elif status == 'exists':
+                print(f"Already in {target}: {title}")
+            else:
+                print(f"Added to {target}: {title}")
+            if self.listener is not None:
+                self.listener(snapshot)
+
+    def _run(self):
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            by_kind = {}
+            for item_id in batch:
+                with self.lock:
+                    record = self.items[item_id]
+                    record['status'] = 'submitting'
+                    record['attempts'] += 1
+                by_kind.setdefault(record['type'], []).append(item_id)
+            for kind, item_ids in by_kind.items():
+                self._submit(self.adders[kind], item_ids)
+
+    def _submit(self, adder, item_ids):
+        payloads = [self.payloads[item_id] for item_id in item_ids]
+        if len(item_ids) > 1:
+            try:
+                if adder.bulk(payloads):
+                    for item_id in item_ids:
+                        self._set(item_id, 'added')
+                    return
+            except TransientAddError as e:
+                for item_id in item_ids:
+                    self._retry(item_id, str(e))
+                return
+
+        # Single title, or the batch was rejected: find out per item
+        for item_id, payload in zip(item_ids, payloads):
+            self.pool.submit(self._submit_one, adder, item_id, payload)
+
+    def _submit_one(self, adder, item_id, payload):
+        try:
+            self._set(item_id, adder.single(payload))
+        except TransientAddError as e:
+            self._retry(item_id, str(e))
+        except Exception as e:
+            self._set(item_id, 'failed', str(e))
+
+    def _retry(self, item_id, error):
+        with self.lock:
+            attempts = self.items[item_id]['attempts']
+        if attempts >= self.max_attempts:
+            self._set(item_id, 'failed', error)
+            return
+        self._set(item_id, 'retrying', error)
+        timer = threading.Timer(self.backoff * 2 ** (attempts - 1), self.pending.put, args=(item_id,))
+        timer.daemon = True
+        timer.start()
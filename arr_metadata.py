@@ -0,0 +1,107 @@
+import threading
+
+
+def _pick(items, wanted, key):
+    """Item whose id or key field matches wanted (case-insensitive), else the first item"""
+    if not items:
+        return None
+    if wanted:
+        wanted = str(wanted).strip().lower()
+        for item in items:
+            if str(item.get('id')) == wanted or str(item.get(key, '')).lower() == wanted:
+                return item
+    return items[0]
+
+
+class ArrMetadata:
+    """Quality profiles, root folders and language profiles of one Radarr/Sonarr instance.
+
+    Loaded once at startup and refreshed in the background, so adding a title
+    costs a single POST. A failed refresh keeps the previous values. Until the
+    first successful load, payloads fall back to quality profile 1 and the
+    configured root folder.
+    """
+
+    def __init__(self, name, session, base_url, root_folder, quality_profile=None,
+                 language_profile=None, languages=False, refresh_interval=3600):
+        self.name = name
+        self.session = session
+        self.base_url = base_url
+        self.root_folder = root_folder
+        self.quality_profile = quality_profile
+        self.language_profile = language_profile
+        self.languages = languages
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.quality_profiles = []
+        self.root_folders = []
+        self.language_profiles = []
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def _get(self, endpoint):
+        r = self.session.get(f"{self.base_url}/api/v3/{endpoint}")
+        r.raise_for_status()
+        return r.json() or []
+
+    def refresh(self):
+        """Reload profiles and root folders. Returns True on success."""
+        try:
+            quality_profiles = self._get("qualityprofile")
+            root_folders = self._get("rootfolder")
+            language_profiles = []
+            if self.languages:
+                # Sonarr v4 dropped language profiles; the endpoint may be gone
+                try:
+                    language_profiles = self._get("languageprofile")
+                except Exception:
+                    language_profiles = []
+        except Exception as e:
+            print(f"Could not refresh {self.name} profiles: {e}")
+            return False
+        with self.lock:
+            self.quality_profiles = quality_profiles
+            self.root_folders = root_folders
+            self.language_profiles = language_profiles
+        return True
+
+    def start(self):
+        """Load now and keep refreshing every refresh_interval seconds"""
+        self.refresh()
+        if self.refresh_interval and self.thread is None:
+            self.thread = threading.Thread(target=self._refresh_loop, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _refresh_loop(self):
+        while not self.stop_event.wait(self.refresh_interval):
+            self.refresh()
+
+    def add_options(self):
+        """qualityProfileId, rootFolderPath and (Sonarr v3) languageProfileId for an add payload"""
+        with self.lock:
+            profile = _pick(self.quality_profiles, self.quality_profile, 'name')
+            options = {
+                "qualityProfileId": profile["id"] if profile else 1,
+                "rootFolderPath": self.root_folder,
+            }
+            # Prefer the configured root folder when the instance knows it
+            paths = [folder.get('path') or '' for folder in self.root_folders]
+            if paths and self.root_folder.rstrip('/') not in [p.rstrip('/') for p in paths]:
+                options["rootFolderPath"] = paths[0]
+            language = _pick(self.language_profiles, self.language_profile, 'name')
+            if language:
+                options["languageProfileId"] = language["id"]
+            return options
+
+    def summary(self):
+        options = self.add_options()
+        with self.lock:
+            return {
+                'quality_profiles': [p.get('name') for p in self.quality_profiles],
+                'root_folders': [f.get('path') for f in self.root_folders],
+                'language_profiles': [p.get('name') for p in self.language_profiles],
+                'add_options': options,
+            }
@@ -0,0 +1,112 @@
+"""Settings and shared wiring for media_tracker.py and simple_dvd_lookup.py.
+
+Both scripts read the same .env and talk to the same Radarr/Sonarr, UPC
+lookup and library files, so the settings, their defaults and the
+construction of the sessions, caches and queues live here once.
+"""
+import os
+from dotenv import load_dotenv
+from library_store import LibraryStore, open_backend
+from library_sync import SyncState, iter_json_array, movie_row, series_row
+from http_client import PooledSession, rate_limiter
+from upc_cache import UpcCache
+from arr_metadata import ArrMetadata
+from add_queue import AddQueue, ArrAdder
+from lookup_cache import LookupCache
+
+# ================= CONFIG =================
+load_dotenv()
+
+RADARR_URL = os.getenv("RADARR_URL", "http://192.168.1.10:7878")
+RADARR_API_KEY = os.getenv("RADARR_API_KEY")
+
+SONARR_URL = os.getenv("SONARR_URL", "http://192.168.1.10:8989")
+SONARR_API_KEY = os.getenv("SONARR_API_KEY")
+
+MOVIE_ROOT = os.getenv("MOVIE_ROOT", "/movies")
+TV_ROOT = os.getenv("TV_ROOT", "/tv")
+RADARR_QUALITY_PROFILE = os.getenv("RADARR_QUALITY_PROFILE")  # id or name; default is the first profile
+SONARR_QUALITY_PROFILE = os.getenv("SONARR_QUALITY_PROFILE")
+SONARR_LANGUAGE_PROFILE = os.getenv("SONARR_LANGUAGE_PROFILE")  # Sonarr v3 only
+ARR_METADATA_REFRESH_MINUTES = float(os.getenv("ARR_METADATA_REFRESH_MINUTES", "60"))
+ADD_BATCH_SIZE = int(os.getenv("ADD_BATCH_SIZE", "20"))
+ADD_BATCH_WAIT_SECONDS = float(os.getenv("ADD_BATCH_WAIT_SECONDS", "2"))
+ADD_WORKERS = int(os.getenv("ADD_WORKERS", "4"))
+ADD_MAX_ATTEMPTS = int(os.getenv("ADD_MAX_ATTEMPTS", "4"))
+
+CSV_FILE = "media_library.csv"
+SQLITE_FILE = os.getenv("SQLITE_FILE", "media_library.db")
+LIBRARY_BACKEND = os.getenv("LIBRARY_BACKEND", "csv")  # "csv" or "sqlite"
+SYNC_STATE_FILE = "media_library_sync.json"
+UPC_CACHE_FILE = os.getenv("UPC_CACHE_FILE", "upc_cache.db")
+UPC_CACHE_TTL_DAYS = float(os.getenv("UPC_CACHE_TTL_DAYS", "90"))
+UPC_NOT_FOUND_TTL_HOURS = float(os.getenv("UPC_NOT_FOUND_TTL_HOURS", "24"))
+UPC_RATE_PER_MINUTE = float(os.getenv("UPC_RATE_PER_MINUTE", "6"))  # UPCItemDB trial tier
+UPC_BURST = int(os.getenv("UPC_BURST", "6"))
+LOOKUP_CACHE_FILE = os.getenv("LOOKUP_CACHE_FILE", "lookup_cache.json")  # empty = memory only
+LOOKUP_CACHE_SIZE = int(os.getenv("LOOKUP_CACHE_SIZE", "200"))
+LOOKUP_CACHE_TTL_HOURS = float(os.getenv("LOOKUP_CACHE_TTL_HOURS", "24"))
+SERIAL_PORT = os.getenv("SERIAL_PORT", None)  # e.g., "COM3" on Windows, "/dev/ttyUSB0" on Linux
+SERIAL_BAUDRATE = int(os.getenv("SERIAL_BAUDRATE", "115200"))
+
+HEADERS_RADARR = {"X-Api-Key": RADARR_API_KEY}
+HEADERS_SONARR = {"X-Api-Key": SONARR_API_KEY}
+
+# Keep-alive connection pools shared by all routes and threads
+radarr = PooledSession(HEADERS_RADARR)
+sonarr = PooledSession(HEADERS_SONARR)
+upcitemdb = PooledSession()
+rate_limiter.configure("api.upcitemdb.com", rate=UPC_RATE_PER_MINUTE / 60, burst=UPC_BURST)
+SYNC_TIMEOUT = (5, 300)  # full library lists can take a while to stream
+
+
+# ============ SHARED SERVICES =============
+
+def open_store():
+    """The configured library (CSV journal or SQLite)"""
+    return LibraryStore(open_backend(LIBRARY_BACKEND, CSV_FILE, SQLITE_FILE))
+
+def open_sync_state():
+    return SyncState(SYNC_STATE_FILE)
+
+def open_upc_cache():
+    return UpcCache(UPC_CACHE_FILE, hit_ttl=UPC_CACHE_TTL_DAYS * 86400, miss_ttl=UPC_NOT_FOUND_TTL_HOURS * 3600)
+
+def open_lookup_cache():
+    return LookupCache(LOOKUP_CACHE_SIZE, ttl=LOOKUP_CACHE_TTL_HOURS * 3600, path=LOOKUP_CACHE_FILE or None)
+
+def arr_metadata():
+    """(Radarr, Sonarr) profile and root folder caches; call start() on each to load them"""
+    refresh_interval = ARR_METADATA_REFRESH_MINUTES * 60
+    return (
+        ArrMetadata("Radarr", radarr, RADARR_URL, MOVIE_ROOT, RADARR_QUALITY_PROFILE,
+                    refresh_interval=refresh_interval),
+        ArrMetadata("Sonarr", sonarr, SONARR_URL, TV_ROOT, SONARR_QUALITY_PROFILE,
+                    SONARR_LANGUAGE_PROFILE, languages=True, refresh_interval=refresh_interval),
+    )
+
+def open_add_queue(listener=None):
+    """Background queue that adds confirmed titles to Radarr/Sonarr"""
+    return AddQueue({
+        'movie': ArrAdder("Radarr", radarr, RADARR_URL, "movie", "MovieExistsValidator"),
+        'series': ArrAdder("Sonarr", sonarr, SONARR_URL, "series", "SeriesExistsValidator"),
+    }, batch_size=ADD_BATCH_SIZE, batch_wait=ADD_BATCH_WAIT_SECONDS, workers=ADD_WORKERS,
+       max_attempts=ADD_MAX_ATTEMPTS, listener=listener)
+
+
+# ========== IMPORT FROM RADARR/SONARR ======
+
+def fetch_radarr():
+    """Stream Radarr's movie list as library rows"""
+    with radarr.get(f"{RADARR_URL}/api/v3/movie", stream=True, timeout=SYNC_TIMEOUT) as r:
+        r.raise_for_status()
+        return [movie_row(m) for m in iter_json_array(r)]
+
+def fetch_sonarr():
+    """Stream Sonarr's series list as library rows"""
+    with sonarr.get(f"{SONARR_URL}/api/v3/series", stream=True, timeout=SYNC_TIMEOUT) as r:
+        r.raise_for_status()
+        return [series_row(s) for s in iter_json_array(r)]
+
+# Fetchers for library_sync.sync_sources
+LIBRARY_SOURCES = {'radarr': fetch_radarr, 'sonarr': fetch_sonarr}
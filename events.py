@@ -0,0 +1,62 @@
+import queue
+import threading
+
+import fast_json
+
+
+def format_sse(event, data):
+    """Encode one Server-Sent Events message (NaN becomes null so JSON.parse accepts it)"""
+    return f"event: {event}\ndata: {fast_json.dumps(data).decode('utf-8')}\n\n"
+
+
+class EventBroker:
+    """Fans published events out to every connected event-stream client.
+
+    Each subscriber gets a bounded queue. A client that falls too far behind
+    is dropped rather than slowing publishers down; its stream ends and the
+    browser's EventSource reconnects and receives a fresh snapshot.
+    """
+
+    def __init__(self, max_pending=100):
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.subscribers = set()
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=self.max_pending)
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def is_subscribed(self, subscriber):
+        with self.lock:
+            return subscriber in self.subscribers
+
+    def publish(self, event, data):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait((event, data))
+            except queue.Full:
+                self.unsubscribe(subscriber)
+
+    def stream(self, subscriber, initial=(), keepalive=15):
+        """Yield SSE text for the initial (event, data) pairs, then for published events"""
+        try:
+            for event, data in initial:
+                yield format_sse(event, data)
+            while self.is_subscribed(subscriber) or not subscriber.empty():
+                try:
+                    event, data = subscriber.get(timeout=keepalive)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event, data)
+        finally:
+            self.unsubscribe(subscriber)
@@ -0,0 +1,119 @@
+import json
+import math
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+def _default(value):
+    """Convert the pandas/numpy values found in library rows to JSON types"""
+    if isinstance(value, np.bool_):
+        return bool(value)
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return None if np.isnan(value) else float(value)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    # pd.NA and pd.NaT (NaT has isoformat(), so check before it)
+    if pd.api.types.is_scalar(value) and pd.isna(value):
+        return None
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _without_nan(value):
+    # The stdlib encoder writes NaN literally; orjson writes null
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, dict):
+        return {k: _without_nan(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_without_nan(v) for v in value]
+    return value
+
+
+def dumps(obj):
+    """Serialize obj to JSON bytes. numpy scalars are native and NaN becomes null.
+
+    Uses orjson when it is installed, otherwise the stdlib encoder.
+    """
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(
+            obj, default=_default,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        )
+    return json.dumps(_without_nan(obj), default=_default, separators=(',', ':')).encode('utf-8')
+
+
+def loads(data):
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# ========== BENCHMARK =====================
+
+def _benchmark(rows=20000, lookups=10, repeat=5):
+    """Compare the previous response path (per-value NaN checks + stdlib json) with dumps()"""
+    import time
+
+    library = [{
+        'type': 'movie' if i % 3 else 'series',
+        'title': f"Title {i}",
+        'year': np.int64(1980 + i % 40),
+        'tmdb_id': np.float64(i) if i % 3 else np.nan,
+        'tvdb_id': np.nan if i % 3 else np.float64(i),
+        'season_count': np.nan if i % 3 else np.float64(i % 9),
+        'has_physical': np.bool_(i % 2),
+        'barcode': str(10 ** 11 + i) if i % 2 else np.nan,
+        'source': 'radarr' if i % 3 else 'sonarr',
+        'genres': 'Drama, Comedy',
+    } for i in range(rows)]
+
+    # Shaped like a Radarr /movie/lookup result
+    lookup = [{
+        'title': f"Result {i}", 'year': 2000 + i, 'tmdbId': 1000 + i,
+        'overview': "An overview of the film. " * 20,
+        'images': [{'coverType': t, 'url': f"https://image.tmdb.org/t/p/original/{i}{t}.jpg",
+                    'remoteUrl': f"https://image.tmdb.org/t/p/original/{i}{t}.jpg"}
+                   for t in ('poster', 'fanart', 'banner')],
+        'ratings': {'imdb': {'votes': 12345, 'value': 7.1}, 'tmdb': {'votes': 2345, 'value': 6.9}},
+        'alternateTitles': [{'title': f"Alt {i}-{j}", 'sourceType': 'tmdb'} for j in range(15)],
+        'genres': ['Drama', 'Thriller'],
+    } for i in range(lookups)]
+
+    def previous(records):
+        # search_local_database-style cleanup, then jsonify's stdlib encoder
+        cleaned = []
+        for record in records:
+            record = dict(record)
+            for key, value in record.items():
+                if value is not None and not isinstance(value, (str, dict, list)) and value != value:
+                    record[key] = None
+            cleaned.append(record)
+        return json.dumps(cleaned, default=_default).encode('utf-8')
+
+    def timed(fn, payload):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn(payload)
+            best = min(best, time.perf_counter() - start)
+        return best * 1000
+
+    encoder = 'orjson' if ORJSON_AVAILABLE else 'stdlib json (orjson not installed)'
+    print(f"Encoder: {encoder}")
+    for name, payload in ((f"/api/media ({rows} rows)", library), (f"/api/lookup ({lookups} results)", lookup)):
+        before, after = timed(previous, payload), timed(dumps, payload)
+        print(f"{name}: previous {before:.1f} ms, dumps {after:.1f} ms ({before / after:.1f}x)")
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,230 @@
+import copy
+import functools
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# (connect, read) seconds; *arr lookups proxy TMDB/TVDB so reads can be slow
+DEFAULT_TIMEOUT = (5, 30)
+
+# Status codes that mean "slow down" rather than "failed"
+RATE_LIMIT_STATUSES = (429, 503)
+
+
+# ============ RATE LIMITING ================
+
+class TokenBucket:
+    """Token bucket that hands out request slots to any number of threads.
+
+    Callers reserve a token and sleep only as long as needed for it to exist,
+    so a burst uses the full allowance and the rest are spread evenly at
+    `rate` per second. penalize() pauses the bucket, e.g. for a Retry-After.
+    rate=None means unlimited (only penalties apply).
+    """
+
+    def __init__(self, rate=None, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.lock = threading.Lock()
+        self.tokens = float(self.burst)
+        # Time the token count was last brought up to date; may lie in the
+        # future while the bucket is paused
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if now > self.updated:
+            if self.rate:
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(0.0, self.updated - now)
+            if self.rate:
+                self.tokens -= 1
+                if self.tokens < 0:
+                    wait += -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+    def penalize(self, seconds):
+        """Send nothing for the next `seconds` (no tokens accrue meanwhile)"""
+        with self.lock:
+            until = time.monotonic() + seconds
+            if until > self.updated:
+                self._refill(time.monotonic())
+                self.updated = until
+                self.tokens = min(self.tokens, 0.0)
+
+
+class RateLimiter:
+    """One token bucket per external host, shared by every thread in the process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def configure(self, host, rate=None, burst=1):
+        """Limit requests to host to `rate` per second with bursts of `burst`"""
+        with self.lock:
+            self.buckets[host] = TokenBucket(rate, burst)
+
+    def bucket(self, host):
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket()
+            return self.buckets[host]
+
+    def acquire(self, host):
+        self.bucket(host).acquire()
+
+    def observe(self, host, response):
+        """Adapt to a response. Returns the back-off in seconds if it was rate limited, else None."""
+        bucket = self.bucket(host)
+        if response.status_code in RATE_LIMIT_STATUSES:
+            delay = _retry_after(response)
+            if delay is None:
+                delay = 1 / bucket.rate if bucket.rate else 5.0
+            bucket.penalize(delay)
+            return delay
+
+        # Pause until the window resets once the quota is used up
+        if response.headers.get('X-RateLimit-Remaining') == '0':
+            try:
+                reset = float(response.headers['X-RateLimit-Reset'])
+            except (KeyError, ValueError):
+                return None
+            if reset > time.time():
+                bucket.penalize(reset - time.time())
+        return None
+
+
+def _retry_after(response):
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# Process-wide limiter; scripts configure per-host limits at startup
+rate_limiter = RateLimiter()
+
+
+# ============ REQUEST COALESCING ===========
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one execution.
+
+    The first caller runs the function; callers that arrive while it is in
+    flight wait for it and receive the same result (or exception). Each caller
+    gets its own deep copy so routes can annotate results independently.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.shared = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+            else:
+                self.shared += 1
+
+        if leader:
+            try:
+                call.result = fn(*args, **kwargs)
+            except Exception as e:
+                call.error = e
+            finally:
+                with self.lock:
+                    del self.calls[key]
+                call.event.set()
+        else:
+            call.event.wait()
+
+        if call.error is not None:
+            raise call.error
+        return copy.deepcopy(call.result)
+
+
+def _normalize_arg(value):
+    if isinstance(value, str):
+        return ' '.join(value.lower().split())
+    return value
+
+# Process-wide in-flight registry
+single_flight = SingleFlight()
+
+def coalesce(endpoint):
+    """Decorator: concurrent calls to endpoint with the same normalized arguments share one request"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (
+                endpoint,
+                tuple(_normalize_arg(a) for a in args),
+                tuple(sorted((k, _normalize_arg(v)) for k, v in kwargs.items())),
+            )
+            return single_flight.do(key, fn, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ============ SESSIONS =====================
+
+class PooledSession(requests.Session):
+    """requests.Session with a keep-alive pool, a default timeout and rate limiting.
+
+    Every request waits for its host's token bucket. Rate-limited responses
+    (429/503) are retried after the server's Retry-After, up to max_retries.
+    """
+
+    def __init__(self, headers=None, pool_size=10, timeout=DEFAULT_TIMEOUT,
+                 limiter=rate_limiter, max_retries=2):
+        super().__init__()
+        self.timeout = timeout
+        self.limiter = limiter
+        self.max_retries = max_retries
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+        if headers:
+            self.headers.update(headers)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        host = urlsplit(url).hostname
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(host)
+            response = super().request(method, url, **kwargs)
+            delay = self.limiter.observe(host, response)
+            if delay is None or attempt == self.max_retries:
+                return response
+            print(f"Rate limited by {host}, retrying in {delay:.1f}s...")
+            response.close()
+        return response
@@ -0,0 +1,987 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from title_index import TitleIndex, library_fingerprint, normalize_title
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking
+    fcntl = None
+
+COLUMNS = [
+    "type", "title", "year",
+    "tmdb_id", "tvdb_id",
+    "season_count",
+    "has_physical", "barcode",
+    "source", "genres"
+]
+
+# External id column used to identify each media type
+ID_COLUMNS = {'movie': 'tmdb_id', 'series': 'tvdb_id'}
+
+# Columns kept in step with Radarr/Sonarr when an item changes upstream
+REFRESH_COLUMNS = ['title', 'year', 'season_count', 'genres']
+
+
+# ============ KEY NORMALIZATION ============
+
+def barcode_key(value):
+    """Normalize a barcode for index lookups (CSV round-trips can turn them into floats)"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    key = str(value).strip()
+    if key.endswith('.0'):
+        key = key[:-2]
+    return key or None
+
+def id_key(value):
+    """Normalize a tmdb/tvdb id to int, or None if missing"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+# ============ STORAGE BACKENDS =============
+
+def _file_signature(*paths):
+    signature = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            signature.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+class StaleLibraryError(Exception):
+    """The library on disk was changed by another process since it was loaded"""
+
+
+class CsvBackend:
+    """Stores the library as a CSV snapshot plus an append-only JSON-lines journal.
+
+    Each mutation is appended to the journal (flushed immediately, fsync'd in
+    batches) so a scan costs O(1) disk writes. load() replays the journal over
+    the snapshot, and replace() (used by LibraryStore.compact) folds it into a
+    new snapshot written atomically via a temp file. The journal's
+    first line records the snapshot it applies to, so a crash between writing
+    a new snapshot and resetting the journal never replays stale entries.
+
+    Other processes may share the files: loading, appending and compacting
+    hold an exclusive lock on a .lock file, and a write is refused with
+    StaleLibraryError if the files changed since this process last read or
+    wrote them, since its row labels may no longer match.
+    """
+
+    stable_labels = False
+
+    def __init__(self, path, fsync_batch=20, fsync_interval=2.0, compact_entries=500):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.lock_path = path + ".lock"
+        self.fsync_batch = fsync_batch
+        self.compact_entries = compact_entries
+        self._journal = None
+        self._entries = 0
+        self._unsynced = 0
+        self._io_lock = threading.Lock()
+        self._lock_file = None
+        self._disk = None  # _disk_state() as of our last load or write
+        if fsync_interval:
+            threading.Thread(target=self._flush_loop, args=(fsync_interval,), daemon=True).start()
+
+    def signature(self):
+        return _file_signature(self.path, self.journal_path)
+
+    # ---------- cross-process coordination ----------
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        if self._lock_file is None:
+            self._lock_file = open(self.lock_path, 'a')
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _disk_state(self):
+        # Inode catches os.replace by a compaction, mtime/size catch appends
+        state = []
+        for path in (self.path, self.journal_path):
+            try:
+                st = os.stat(path)
+                state.append((st.st_ino, st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                state.append(None)
+        return tuple(state)
+
+    def _check_current(self):
+        if self._disk is not None and self._disk_state() != self._disk:
+            raise StaleLibraryError(f"{self.path} was changed by another process; reload before writing")
+
+    # ---------- snapshot ----------
+
+    def _read_snapshot(self):
+        if os.path.exists(self.path):
+            print(f"Loading database from {self.path}")
+            df = pd.read_csv(self.path, dtype={'barcode': str})
+            # Ensure genres column exists (for backward compatibility)
+            if 'genres' not in df.columns:
+                df['genres'] = ''
+            # Fill NaN values in genres column
+            df['genres'] = df['genres'].fillna('')
+            return df
+        print("Creating new database")
+        return pd.DataFrame(columns=COLUMNS)
+
+    def _snapshot_id(self):
+        st = os.stat(self.path)
+        return [st.st_mtime_ns, st.st_size]
+
+    def _write_snapshot(self, df):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', newline='') as f:
+            df.to_csv(f, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    # ---------- journal ----------
+
+    def _read_journal(self):
+        """Return journal entries that belong to the current snapshot"""
+        if not os.path.exists(self.journal_path) or not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.journal_path, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # A torn write can only be the last line; anything after it is unusable
+                print(f"Ignoring incomplete journal entry in {self.journal_path}")
+                break
+        if not entries or entries[0].get('snapshot') != self._snapshot_id():
+            return []
+        return entries[1:]
+
+    def _reset_journal(self):
+        """Start a fresh journal for the current snapshot (atomically replacing the old one)"""
+        if self._journal is not None:
+            self._journal.close()
+        tmp_path = self.journal_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'snapshot': self._snapshot_id()}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        self._entries = 0
+        self._unsynced = 0
+
+    def _append(self, entries):
+        with self._io_lock, self._file_lock():
+            self._check_current()
+            if self._journal is None:
+                if not os.path.exists(self.path):
+                    self._write_snapshot(pd.DataFrame(columns=COLUMNS))
+                if os.path.exists(self.journal_path) and self._journal_matches():
+                    self._repair_tail()
+                    self._journal = open(self.journal_path, 'a', encoding='utf-8')
+                else:
+                    self._reset_journal()
+            for entry in entries:
+                self._journal.write(json.dumps(entry) + "\n")
+            self._journal.flush()
+            self._disk = self._disk_state()
+            self._entries += len(entries)
+            self._unsynced += len(entries)
+            if self._unsynced >= self.fsync_batch:
+                self._sync()
+
+    def _journal_matches(self):
+        with open(self.journal_path, encoding='utf-8') as f:
+            header = f.readline()
+        try:
+            return json.loads(header).get('snapshot') == self._snapshot_id()
+        except ValueError:
+            return False
+
+    def _repair_tail(self):
+        """End the journal on a complete line so new entries are not glued onto a torn one"""
+        with open(self.journal_path, 'rb+') as f:
+            data = f.read()
+            if not data or data.endswith(b"\n"):
+                return
+            end = data.rfind(b"\n") + 1
+            try:
+                # The entry is whole and only its newline is missing; load() applied it
+                json.loads(data[end:])
+                f.write(b"\n")
+            except ValueError:
+                print(f"Truncating incomplete journal entry in {self.journal_path}")
+                f.truncate(end)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _sync(self):
+        os.fsync(self._journal.fileno())
+        self._unsynced = 0
+
+    def _flush_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            with self._io_lock:
+                if self._journal is not None and self._unsynced:
+                    self._sync()
+
+    # ---------- backend interface ----------
+
+    def _close_journal(self):
+        if self._journal is not None:
+            self._sync()
+            self._journal.close()
+            self._journal = None
+
+    def load(self):
+        with self._io_lock, self._file_lock():
+            # The journal may have been replaced by another process's compaction;
+            # reopen it on the next append rather than writing to the old file
+            self._close_journal()
+            df = self._read_snapshot()
+            entries = self._read_journal()
+            self._entries = len(entries)
+            self._disk = self._disk_state()
+        for entry in entries:
+            if entry['op'] == 'update':
+                for column, value in entry['values'].items():
+                    df.loc[entry['id'], column] = value
+            elif entry['op'] == 'insert':
+                df.loc[entry['id']] = [entry['values'].get(c) for c in df.columns]
+            elif entry['op'] == 'delete':
+                df = df.drop(index=entry['id'], errors='ignore')
+        return df
+
+    def write(self, df, updated=(), inserted=(), deleted=()):
+        """Journal changed, new and deleted rows as one batch"""
+        self._append(
+            [{'op': 'delete', 'id': int(label)} for label in deleted] +
+            [{'op': 'update', 'id': int(label), 'values': _row_values(df, label)} for label in updated] +
+            [{'op': 'insert', 'id': int(label), 'values': _row_values(df, label)} for label in inserted]
+        )
+
+    def replace(self, df):
+        """Write df as the new snapshot and empty the journal (df must use a 0..n-1 index)"""
+        with self._io_lock, self._file_lock():
+            self._check_current()
+            self._write_snapshot(df)
+            self._reset_journal()
+            self._disk = self._disk_state()
+
+    def needs_compaction(self):
+        return self._entries >= self.compact_entries
+
+    def close(self):
+        with self._io_lock:
+            self._close_journal()
+
+
+def _row_values(df, label):
+    """Row values as plain JSON-serializable Python objects"""
+    values = {}
+    for column, value in df.loc[label].items():
+        if value is None or (not isinstance(value, str) and pd.isna(value)):
+            value = None
+        elif hasattr(value, 'item'):
+            value = value.item()
+        values[column] = value
+    return values
+
+
+class SqliteBackend:
+    """Stores the library in SQLite (WAL mode) with one row per title.
+
+    The DataFrame index is the table's primary key, so scans and toggles
+    become single-row UPDATE/INSERT statements.
+    """
+
+    stable_labels = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS media (
+            id INTEGER PRIMARY KEY,
+            type TEXT NOT NULL,
+            title TEXT,
+            year INTEGER,
+            tmdb_id INTEGER,
+            tvdb_id INTEGER,
+            season_count INTEGER,
+            has_physical INTEGER NOT NULL DEFAULT 0,
+            barcode TEXT,
+            source TEXT,
+            genres TEXT NOT NULL DEFAULT ''
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS media_barcode ON media(barcode);
+        CREATE UNIQUE INDEX IF NOT EXISTS media_tmdb ON media(type, tmdb_id);
+        CREATE UNIQUE INDEX IF NOT EXISTS media_tvdb ON media(type, tvdb_id);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Access is serialized by LibraryStore.lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def signature(self):
+        return _file_signature(self.path, self.path + "-wal")
+
+    def load(self):
+        print(f"Loading database from {self.path}")
+        df = pd.read_sql_query(
+            f"SELECT id, {', '.join(COLUMNS)} FROM media ORDER BY id",
+            self.conn, index_col='id'
+        )
+        df.index.name = None
+        df['has_physical'] = df['has_physical'].fillna(0).astype(bool)
+        df['genres'] = df['genres'].fillna('')
+        return df
+
+    def _params(self, df, label):
+        row = df.loc[label]
+        return [_sql_value(row[c]) for c in COLUMNS] + [int(label)]
+
+    def write(self, df, updated=(), inserted=(), deleted=()):
+        """DELETE, UPDATE and INSERT rows in a single transaction"""
+        with self.conn:
+            if deleted:
+                self.conn.executemany("DELETE FROM media WHERE id = ?", [(int(label),) for label in deleted])
+            if updated:
+                self.conn.executemany(
+                    f"UPDATE media SET {', '.join(f'{c} = ?' for c in COLUMNS)} WHERE id = ?",
+                    [self._params(df, label) for label in updated]
+                )
+            if inserted:
+                self.conn.executemany(
+                    f"INSERT INTO media ({', '.join(COLUMNS)}, id) VALUES ({', '.join('?' * (len(COLUMNS) + 1))})",
+                    [self._params(df, label) for label in inserted]
+                )
+
+    def replace(self, df):
+        with self.conn:
+            self.conn.execute("DELETE FROM media")
+            self.conn.executemany(
+                f"INSERT INTO media ({', '.join(COLUMNS)}, id) VALUES ({', '.join('?' * (len(COLUMNS) + 1))})",
+                [self._params(df, label) for label in df.index]
+            )
+
+    def needs_compaction(self):
+        # WAL checkpoints are handled by SQLite itself
+        return False
+
+    def close(self):
+        self.conn.close()
+
+
+def _sql_value(value):
+    """Convert pandas/numpy scalars into types sqlite3 accepts"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def migrate_csv_to_sqlite(csv_path, sqlite_path):
+    """One-shot copy of an existing CSV library into a new SQLite database.
+
+    Rows that would violate the unique indexes are reported: duplicate
+    barcodes are cleared on all but the first row, and rows with a duplicate
+    tmdb/tvdb id are merged into the first (keeping any physical copy and
+    barcode). The CSV file is left untouched as a backup.
+    """
+    df = CsvBackend(csv_path, fsync_interval=0).load()
+    for column in COLUMNS:
+        if column not in df.columns:
+            df[column] = None
+    df = df[COLUMNS].reset_index(drop=True)
+    df['has_physical'] = df['has_physical'].fillna(False).astype(str).str.lower().isin(['true', '1'])
+    df['barcode'] = df['barcode'].map(barcode_key)
+
+    dup_barcodes = df['barcode'].notna() & df.duplicated('barcode')
+    if dup_barcodes.any():
+        print(f"Migration: clearing {int(dup_barcodes.sum())} duplicate barcode(s)")
+        df.loc[dup_barcodes, 'barcode'] = None
+
+    # Rows sharing an id (e.g. a title-only import next to a scanned copy) are
+    # collapsed to the first; carry the physical copy and barcode over to it first
+    for id_column in ('tmdb_id', 'tvdb_id'):
+        keyed = df[id_column].notna()
+        groups = df[keyed].groupby(['type', id_column])
+        df.loc[keyed, 'has_physical'] = groups['has_physical'].transform('max').astype(bool)
+        df.loc[keyed, 'barcode'] = groups['barcode'].transform('first')
+
+    dup_ids = (
+        (df['tmdb_id'].notna() & df.duplicated(['type', 'tmdb_id'])) |
+        (df['tvdb_id'].notna() & df.duplicated(['type', 'tvdb_id']))
+    )
+    if dup_ids.any():
+        print(f"Migration: merging {int(dup_ids.sum())} row(s) with duplicate tmdb/tvdb ids into the first")
+        df = df[~dup_ids]
+
+    backend = SqliteBackend(sqlite_path)
+    backend.replace(df)
+    print(f"Migrated {len(df)} items from {csv_path} to {sqlite_path}")
+    return backend
+
+
+def open_backend(kind, csv_path, sqlite_path):
+    """Create the configured storage backend ('csv' or 'sqlite')"""
+    if kind == 'sqlite':
+        if not os.path.exists(sqlite_path) and os.path.exists(csv_path):
+            return migrate_csv_to_sqlite(csv_path, sqlite_path)
+        return SqliteBackend(sqlite_path)
+    if kind != 'csv':
+        raise ValueError(f"Unknown library backend: {kind}")
+    return CsvBackend(csv_path)
+
+
+# =============== LIBRARY STORE =============
+
+def split_genres(value):
+    """List of genres from a comma-joined genres cell"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return []
+    return [g.strip() for g in str(value).split(',') if g.strip()]
+
+
+class LibraryAggregates:
+    """Type/physical counts and per-type genre histograms kept in step with the rows.
+
+    The store adds a row's contribution when it is indexed and subtracts it
+    when it is unindexed, so each add, toggle or sync costs O(genres) and
+    reading the totals never touches the row data.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.types = {}
+        self.physical = 0
+        self.genres = {'movie': {}, 'series': {}, 'all': {}}
+
+    def add(self, row, sign=1):
+        media_type = row['type']
+        self.types[media_type] = self.types.get(media_type, 0) + sign
+        if _is_true(row['has_physical']):
+            self.physical += sign
+        self.add_genres(media_type, row['genres'], sign)
+
+    def remove(self, row):
+        self.add(row, -1)
+
+    def add_genres(self, media_type, genres, sign=1):
+        groups = [self.genres['all']]
+        if media_type in self.genres:
+            groups.append(self.genres[media_type])
+        for genre in split_genres(genres):
+            for counts in groups:
+                count = counts.get(genre, 0) + sign
+                if count:
+                    counts[genre] = count
+                else:
+                    del counts[genre]
+
+    def stats(self):
+        return {
+            'movies': self.types.get('movie', 0),
+            'series': self.types.get('series', 0),
+            'dvds': self.physical
+        }
+
+    def genre_stats(self):
+        return {
+            'movies': dict(self.genres['movie']),
+            'series': dict(self.genres['series']),
+            'all': dict(self.genres['all'])
+        }
+
+
+class LibraryStore:
+    """In-memory copy of the media library shared by every route and worker thread.
+
+    The DataFrame is loaded once and kept until the backing storage changes
+    on disk (detected by mtime/size) or until it is written through this store.
+    Barcode and tmdb/tvdb ids are kept in hash indexes for O(1) lookups, and
+    titles in a trigram index that is saved next to the library.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.title_index_path = backend.path + ".titleidx"
+        self.lock = threading.RLock()
+        # Notified whenever version changes
+        self.changed = threading.Condition(self.lock)
+        self.version = 0
+        # Wall-clock time of the last version change (for Last-Modified)
+        self.modified = time.time()
+        self._compacting = False
+        self._df = None
+        self._read_frame = None  # frame that exports are iterating over, and how many
+        self._readers = 0
+        self._signature = None
+        self._by_barcode = {}
+        self._by_tmdb = {}
+        self._by_tvdb = {}
+        self._aggregates = LibraryAggregates()
+        self._titles = None
+        self._titles_dirty = False
+
+    # ---------- loading ----------
+
+    def frame(self):
+        """Return the cached library, reloading it only if storage changed on disk.
+
+        The returned DataFrame is shared; modify it through update()/append()/save().
+        """
+        with self.lock:
+            signature = self.backend.signature()
+            if self._df is None or signature != self._signature:
+                self._df = self.backend.load()
+                self._signature = signature
+                self._rebuild_indexes()
+                self.version += 1
+                self.modified = time.time()
+                self.changed.notify_all()
+            return self._df
+
+    def wait_for_change(self, version, timeout=None):
+        """Block until the library version differs from version (or timeout); returns the current version.
+
+        Only writes through this process wake waiters early; call frame()
+        afterwards to pick up changes other processes made on disk.
+        """
+        with self.changed:
+            self.changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def invalidate(self):
+        """Drop the cached copy so the next frame() call reloads from storage"""
+        with self.lock:
+            self._df = None
+            self._signature = None
+
+    # ---------- indexes ----------
+
+    def _rebuild_indexes(self, keep_titles=False):
+        if not keep_titles:
+            self._titles = None
+        self._by_barcode = {}
+        self._by_tmdb = {}
+        self._by_tvdb = {}
+        self._aggregates.reset()
+        for label in self._df.index:
+            self._index_row(label)
+
+    def _index_row(self, label):
+        row = self._df.loc[label]
+        self._aggregates.add(row)
+        barcode = barcode_key(row['barcode'])
+        if barcode is not None:
+            self._by_barcode.setdefault(barcode, label)
+        tmdb_id = id_key(row['tmdb_id'])
+        if tmdb_id is not None:
+            self._by_tmdb.setdefault((row['type'], tmdb_id), label)
+        tvdb_id = id_key(row['tvdb_id'])
+        if tvdb_id is not None:
+            self._by_tvdb.setdefault((row['type'], tvdb_id), label)
+
+    def _unindex_row(self, label):
+        row = self._df.loc[label]
+        self._aggregates.remove(row)
+        for index, key in (
+            (self._by_barcode, barcode_key(row['barcode'])),
+            (self._by_tmdb, (row['type'], id_key(row['tmdb_id']))),
+            (self._by_tvdb, (row['type'], id_key(row['tvdb_id']))),
+        ):
+            if index.get(key) == label:
+                del index[key]
+
+    def find_barcode(self, barcode):
+        """Return the index label of the row with this barcode, or None"""
+        with self.lock:
+            self.frame()
+            return self._by_barcode.get(barcode_key(barcode))
+
+    def find_external(self, media_type, tmdb_id=None, tvdb_id=None):
+        """Return the index label of the row with this tmdb/tvdb id, or None"""
+        with self.lock:
+            self.frame()
+            if id_key(tmdb_id) is not None:
+                return self._by_tmdb.get((media_type, id_key(tmdb_id)))
+            if id_key(tvdb_id) is not None:
+                return self._by_tvdb.get((media_type, id_key(tvdb_id)))
+            return None
+
+    def external_ids(self, media_type):
+        """Set of tmdb (movies) or tvdb (series) ids present in the library, read in one pass"""
+        with self.lock:
+            self.frame()
+            return {item_id for kind, item_id in self._id_index(ID_COLUMNS[media_type]) if kind == media_type}
+
+    def stats(self):
+        """Movie, series and physical copy counts"""
+        with self.lock:
+            self.frame()
+            return self._aggregates.stats()
+
+    def genre_stats(self):
+        """Genre counts for movies, series and both"""
+        with self.lock:
+            self.frame()
+            return self._aggregates.genre_stats()
+
+    def query(self, media_type=None, has_physical=None, year_min=None, year_max=None,
+              genre=None, source=None, fields=None, offset=0, limit=None):
+        """Return (total matches, records) for rows matching every given filter.
+
+        Filters are evaluated as vectorized column masks; only the requested
+        page is converted to dicts, restricted to `fields` if given. Missing
+        values come back as None.
+        """
+        with self.lock:
+            df = self.frame()
+            mask = np.ones(len(df), dtype=bool)
+            if media_type:
+                mask &= (df['type'] == media_type).to_numpy()
+            if has_physical is not None:
+                physical = df['has_physical'].astype(str).str.strip().str.lower().isin(['true', '1'])
+                mask &= (physical == has_physical).to_numpy()
+            if year_min is not None or year_max is not None:
+                years = pd.to_numeric(df['year'], errors='coerce')
+                if year_min is not None:
+                    mask &= (years >= year_min).to_numpy()
+                if year_max is not None:
+                    mask &= (years <= year_max).to_numpy()
+            if genre:
+                pattern = rf"(?:^|,)\s*{re.escape(genre.strip())}\s*(?:,|$)"
+                mask &= df['genres'].fillna('').astype(str).str.contains(pattern, case=False, regex=True).to_numpy()
+            if source:
+                mask &= (df['source'] == source).to_numpy()
+
+            labels = df.index[mask]
+            stop = None if limit is None else offset + limit
+            page = df.loc[labels[offset:stop], fields or COLUMNS]
+            records = page.astype(object).where(page.notna(), None).to_dict('records')
+            return len(labels), records
+
+    def iter_chunks(self, chunk_size=500):
+        """Yield the library as DataFrames of up to chunk_size rows.
+
+        Rows come from the library as it was when iteration started. The
+        cached frame is shared rather than copied: while an export is reading
+        it, the next in-place write copies the frame first (see _writable_frame),
+        so concurrent exports cost at most one extra copy between them.
+        """
+        with self.lock:
+            df = self.frame()
+            if self._read_frame is not df:
+                self._read_frame, self._readers = df, 0
+            self._readers += 1
+        try:
+            for start in range(0, len(df), chunk_size):
+                yield df.iloc[start:start + chunk_size]
+        finally:
+            with self.lock:
+                if self._read_frame is df:
+                    self._readers -= 1
+                    if not self._readers:
+                        self._read_frame = None
+
+    def _writable_frame(self):
+        """The cached frame, copied first if an export is still reading it"""
+        df = self.frame()
+        if self._read_frame is df:
+            self._df = df = df.copy()
+            self._read_frame, self._readers = None, 0
+        return df
+
+    def title_index(self):
+        """Return the fuzzy-search index for the current library, building it if needed"""
+        with self.lock:
+            df = self.frame()
+            if self._titles is None:
+                fingerprint = library_fingerprint(df)
+                self._titles = TitleIndex.load(self.title_index_path, fingerprint)
+                if self._titles is None:
+                    print("Building title index")
+                    self._titles = TitleIndex.build(df)
+                    self._titles.save(self.title_index_path, fingerprint)
+                self._titles_dirty = False
+            return self._titles
+
+    def _save_title_index(self):
+        if self._titles is not None and self._titles_dirty:
+            self._titles.save(self.title_index_path, library_fingerprint(self._df))
+            self._titles_dirty = False
+
+    def row(self, label):
+        """Return a single row as a dict"""
+        with self.lock:
+            return self.frame().loc[label].to_dict()
+
+    # ---------- writing ----------
+
+    def _written(self):
+        self._signature = self.backend.signature()
+        self.version += 1
+        self.modified = time.time()
+        self.changed.notify_all()
+        if not self._compacting and self.backend.needs_compaction():
+            self._compacting = True
+            threading.Thread(target=self.compact, daemon=True).start()
+
+    def _persist(self, **changes):
+        """Write rows already changed in the cache; if the backend refuses, drop the cache"""
+        try:
+            self.backend.write(self._df, **changes)
+        except Exception:
+            # Frame, indexes and aggregates hold a change storage doesn't; reload on next access
+            self.invalidate()
+            raise
+        self._written()
+
+    def compact(self):
+        """Fold the backend's journal into a new snapshot (no-op for SQLite)"""
+        with self.lock:
+            try:
+                if self._df is not None and self.backend.needs_compaction():
+                    df = self._df
+                    relabel = None
+                    if not self.backend.stable_labels:
+                        relabel = dict(zip(df.index, range(len(df))))
+                        df = df.reset_index(drop=True)
+                    self.backend.replace(df)
+                    # Only relabel once the new snapshot is on disk; a failed replace keeps the old labels
+                    if relabel is not None and self._titles is not None:
+                        self._titles.relabel(relabel)
+                        self._titles_dirty = True
+                    self._df = df
+                    self._rebuild_indexes(keep_titles=True)
+                    self._save_title_index()
+                    self._signature = self.backend.signature()
+                    print(f"Compacted library journal ({len(df)} items)")
+            except Exception as e:
+                print(f"Error compacting library: {e}")
+            finally:
+                self._compacting = False
+
+    def close(self):
+        """Flush pending writes to disk"""
+        with self.lock:
+            if self._df is not None:
+                self._save_title_index()
+            self.backend.close()
+
+    def save(self, df):
+        """Replace the whole library with df and persist it"""
+        with self.lock:
+            if not self.backend.stable_labels:
+                df = df.reset_index(drop=True)
+            self.backend.replace(df)
+            self._df = df
+            self._rebuild_indexes()
+            self._written()
+
+    def update(self, label, values):
+        """Set column values on a single row and persist; returns the updated row as a dict"""
+        with self.lock:
+            df = self._writable_frame()
+            self._unindex_row(label)
+            for column, value in values.items():
+                df.loc[label, column] = value
+            self._index_row(label)
+            if self._titles is not None and {'title', 'type', 'year'} & set(values):
+                self._titles.replace(df.loc[[label]])
+                self._titles_dirty = True
+            self._persist(updated=[label])
+            return df.loc[label].to_dict()
+
+    def _add_rows(self, rows):
+        """Add rows to the cached frame and indexes; returns their new labels"""
+        df = self._df
+        start = int(df.index.max()) + 1 if len(df) else 0
+        labels = list(range(start, start + len(rows)))
+        new = pd.DataFrame(rows, index=labels).reindex(columns=df.columns)
+        new['genres'] = new['genres'].fillna('')
+        self._df = pd.concat([df, new])
+        for label in labels:
+            self._index_row(label)
+        if self._titles is not None:
+            self._titles.add(self._df.loc[labels])
+            self._titles_dirty = True
+        return labels
+
+    def append(self, rows):
+        """Append new rows (list of dicts) and persist; returns their index labels"""
+        if not rows:
+            return []
+        with self.lock:
+            self.frame()
+            labels = self._add_rows(rows)
+            self._persist(inserted=labels)
+            return labels
+
+    def _remove_rows(self, labels):
+        """Drop rows from the cached frame and indexes"""
+        for label in labels:
+            self._unindex_row(label)
+            if self._titles is not None:
+                self._titles.remove(label)
+                self._titles_dirty = True
+        self._df = self._df.drop(index=labels)
+
+    def merge(self, rows, removed=(), refresh=False):
+        """Merge items imported from Radarr/Sonarr into the library with a single write.
+
+        Items are hash-joined on (type, tmdb_id) for movies and (type, tvdb_id)
+        for series, falling back to (type, normalized title) against library
+        rows that have no id yet; a title match takes the item's id. Unmatched
+        items are appended in one batch.
+        Matched rows get empty genres backfilled, or with refresh=True have
+        title, year, season_count and genres brought up to date.
+
+        removed is a list of (type, id) keys that disappeared upstream; their
+        rows are deleted unless a physical copy is recorded.
+
+        Returns counts of added, updated, unchanged, removed and kept items.
+        """
+        counts = {'added': 0, 'updated': 0, 'unchanged': 0, 'removed': 0, 'kept': 0}
+        if not rows and not removed:
+            return counts
+        with self.lock:
+            df = self._writable_frame()
+            by_title = None
+            matched = {}
+            adopted = {}  # label -> (id column, key) for rows matched by title
+            new_rows = []
+            seen = set()
+            for row in rows:
+                media_type = row['type']
+                id_column = ID_COLUMNS[media_type]
+                key = (media_type, id_key(row.get(id_column)))
+                if key[1] is not None:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                label = self._id_index(id_column).get(key)
+                if label is None:
+                    if by_title is None:
+                        by_title = _titles_without_ids(df)
+                    title_key = (media_type, normalize_title(row['title']))
+                    label = by_title.get(title_key)
+                    if label is not None and key[1] is not None:
+                        # The row takes this item's id, so it can't match another title
+                        del by_title[title_key]
+                        adopted[label] = (id_column, key)
+                if label is None:
+                    new_rows.append(row)
+                else:
+                    matched.setdefault(label, row)
+
+            updated = set()
+            if matched:
+                labels = list(matched)
+                incoming = pd.DataFrame(list(matched.values()), index=labels).reindex(columns=df.columns)
+                current = df.loc[labels]
+                columns = REFRESH_COLUMNS if refresh else ['genres']
+                for column in columns:
+                    new = incoming[column]
+                    old = current[column]
+                    if column == 'genres':
+                        new = new.fillna('')
+                        old = old.fillna('')
+                        differs = (new != '') & ((old != new) if refresh else (old == ''))
+                    else:
+                        differs = new.notna() & ~((old == new) | old.isna() & new.isna())
+                    changed = differs[differs].index
+                    if len(changed) and column == 'genres':
+                        for label in changed:
+                            media_type = df.loc[label, 'type']
+                            self._aggregates.add_genres(media_type, old[label], -1)
+                            self._aggregates.add_genres(media_type, new[label])
+                    if len(changed):
+                        df.loc[changed, column] = new[changed]
+                        updated.update(changed)
+                        if column in ('title', 'year') and self._titles is not None:
+                            self._titles.replace(df.loc[changed])
+                            self._titles_dirty = True
+            # Record the upstream id on title matches so later syncs and lookups find them by id
+            for label, (id_column, key) in adopted.items():
+                df.loc[label, id_column] = key[1]
+                self._id_index(id_column).setdefault(key, label)
+                updated.add(label)
+            updated = list(updated)
+
+            deleted = []
+            for media_type, item_id in removed:
+                label = self._id_index(ID_COLUMNS[media_type]).get((media_type, id_key(item_id)))
+                if label is None or label in matched:
+                    continue
+                if _is_true(df.loc[label, 'has_physical']):
+                    # Still on the shelf; keep the row even though the *arr dropped it
+                    counts['kept'] += 1
+                else:
+                    deleted.append(label)
+
+            if deleted:
+                self._remove_rows(deleted)
+            inserted = self._add_rows(new_rows) if new_rows else []
+            if updated or inserted or deleted:
+                self._persist(updated=updated, inserted=inserted, deleted=deleted)
+
+            counts['added'] = len(inserted)
+            counts['updated'] = len(updated)
+            counts['unchanged'] = len(matched) - len(updated)
+            counts['removed'] = len(deleted)
+            return counts
+
+    def _id_index(self, id_column):
+        return self._by_tmdb if id_column == 'tmdb_id' else self._by_tvdb
+
+
+def _is_true(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', '1')
+    return bool(value) and not pd.isna(value)
+
+
+def _titles_without_ids(df):
+    """Map (type, normalized title) -> label for rows missing their tmdb/tvdb id"""
+    lookup = {}
+    for media_type, id_column in ID_COLUMNS.items():
+        subset = df[(df['type'] == media_type) & df[id_column].isna()]
+        for label, title in zip(subset.index, subset['title']):
+            lookup.setdefault((media_type, normalize_title(title)), label)
+    return lookup
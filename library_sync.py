@@ -0,0 +1,199 @@
+import codecs
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from library_store import ID_COLUMNS, id_key
+
+# Which library type each upstream source feeds
+SOURCE_TYPES = {'radarr': 'movie', 'sonarr': 'series'}
+
+
+# ========== STREAMING JSON ================
+
+def iter_json_array(response, chunk_size=65536):
+    """Yield the elements of a top-level JSON array from a streamed response one at a time.
+
+    Only the current chunk and the element being decoded are held in memory,
+    so large /api/v3/movie and /api/v3/series payloads never materialize as a
+    whole. The response should be requested with stream=True.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+    chunks = response.iter_content(chunk_size=chunk_size)
+    buffer = ''
+    eof = False
+    started = False
+
+    while True:
+        buffer = buffer.lstrip()
+        if buffer and not started:
+            if buffer[0] != '[':
+                raise ValueError("Expected a JSON array")
+            buffer = buffer[1:]
+            started = True
+            continue
+        if buffer and buffer[0] == ']':
+            return
+        if buffer and buffer[0] == ',':
+            buffer = buffer[1:]
+            continue
+        if buffer:
+            try:
+                item, end = decoder.raw_decode(buffer)
+                # A bare value at the end of the buffer may still be incomplete
+                if end < len(buffer) or eof or isinstance(item, (dict, list)):
+                    buffer = buffer[end:]
+                    yield item
+                    continue
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+        if eof:
+            raise ValueError("Truncated JSON array")
+        try:
+            buffer += text.decode(next(chunks))
+        except StopIteration:
+            buffer += text.decode(b'', final=True)
+            eof = True
+
+
+# ========== ITEM PROJECTION ================
+
+def movie_row(m):
+    """Library row for a Radarr movie"""
+    return {
+        "type": "movie",
+        "title": m["title"],
+        "year": m["year"],
+        "tmdb_id": m["tmdbId"],
+        "tvdb_id": None,
+        "season_count": None,
+        "has_physical": False,
+        "barcode": None,
+        "source": "radarr",
+        "genres": ", ".join(m.get("genres") or [])
+    }
+
+def series_row(s):
+    """Library row for a Sonarr series"""
+    return {
+        "type": "series",
+        "title": s["title"],
+        "year": s["year"],
+        "tmdb_id": None,
+        "tvdb_id": s["tvdbId"],
+        "season_count": len(s["seasons"]),
+        "has_physical": False,
+        "barcode": None,
+        "source": "sonarr",
+        "genres": ", ".join(s.get("genres") or [])
+    }
+
+def fingerprint(row):
+    """Content hash of the fields the library keeps for an item"""
+    return hashlib.sha1(json.dumps(row, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+# ========== SYNC STATE =====================
+
+class SyncState:
+    """Per-item fingerprints recorded by the previous sync, keyed by source and tmdb/tvdb id"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.fingerprints = {}
+        try:
+            with open(path, encoding='utf-8') as f:
+                self.fingerprints = json.load(f)
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            print(f"Ignoring unreadable sync state {path}: {e}")
+
+    def get(self, source):
+        with self.lock:
+            return dict(self.fingerprints.get(source, {}))
+
+    def put(self, source, fingerprints):
+        """Replace the fingerprints for a source and save the state file"""
+        with self.lock:
+            self.fingerprints[source] = fingerprints
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.fingerprints, f)
+            os.replace(tmp_path, self.path)
+
+
+# ========== APPLY ==========================
+
+def _plan_source(store, state, source, rows, incremental):
+    """Work out which items of one source need applying.
+
+    Returns (changed rows, removed (type, id) keys, new fingerprints). In
+    incremental mode only items whose fingerprint differs from the previous
+    sync are returned; items that were present last time but are gone now
+    are reported as removals.
+    """
+    media_type = SOURCE_TYPES[source]
+    id_column = ID_COLUMNS[media_type]
+    previous = state.get(source)
+    # One locked read of the id index instead of a lookup per item
+    in_library = store.external_ids(media_type) if incremental else set()
+
+    current = {}
+    changed = []
+    for row in rows:
+        key = id_key(row[id_column])
+        if key is None:
+            changed.append(row)
+            continue
+        current[str(key)] = fp = fingerprint(row)
+        # Items missing from the library (e.g. a fresh database) are always applied
+        if not incremental or previous.get(str(key)) != fp or key not in in_library:
+            changed.append(row)
+
+    removed = [(media_type, int(key)) for key in previous if key not in current]
+    if previous and not current:
+        # An empty list from a previously populated instance is more likely a
+        # misconfiguration than a wiped library; don't delete everything
+        print(f"{source} returned no items; skipping removal of {len(removed)} item(s)")
+        return changed, [], previous
+    return changed, removed, current
+
+
+def sync_sources(store, state, fetchers, incremental=True):
+    """Fetch every source concurrently, then apply all changes to the library in one write.
+
+    fetchers maps a source name ('radarr'/'sonarr') to a callable returning
+    that source's items as library rows. A source that fails to fetch is
+    reported and skipped; the others are still applied.
+    """
+    with ThreadPoolExecutor(max_workers=len(fetchers)) as pool:
+        futures = {source: pool.submit(fetch) for source, fetch in fetchers.items()}
+
+    sources = {}
+    changed = []
+    removed = []
+    fingerprints = {}
+    skipped = 0
+    for source, future in futures.items():
+        try:
+            rows = future.result()
+        except Exception as e:
+            print(f"Error importing from {source}: {e}")
+            sources[source] = {'error': str(e)}
+            continue
+        source_changed, source_removed, fingerprints[source] = _plan_source(store, state, source, rows, incremental)
+        changed.extend(source_changed)
+        removed.extend(source_removed)
+        skipped += len(rows) - len(source_changed)
+        sources[source] = {'items': len(rows), 'changed': len(source_changed), 'removed': len(source_removed)}
+
+    counts = store.merge(changed, removed=removed, refresh=True)
+    counts['unchanged'] += skipped
+    for source, current in fingerprints.items():
+        state.put(source, current)
+    return {'counts': counts, 'sources': sources}
@@ -0,0 +1,108 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_term(term):
+    """Case- and whitespace-insensitive form of a search term"""
+    return ' '.join(str(term).lower().split())
+
+
+class LookupCache:
+    """LRU cache of Radarr/Sonarr lookup results keyed by kind and normalized search term.
+
+    *arr lookups proxy TMDB/TVDB and take seconds, so search-as-you-type and
+    repeat lookups during a scan session are served from here. At most
+    max_entries results are held; the least recently used are evicted first
+    and entries expire after ttl seconds. With a path, the cache is loaded at
+    startup and written back by save() so a restart begins warm; save() runs
+    on its own save_delay seconds after a put(), batching bursts of lookups
+    into one write.
+    """
+
+    def __init__(self, max_entries=200, ttl=86400, path=None, save_delay=30):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.path = path
+        self.save_delay = save_delay
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.save_timer = None
+        self.entries = OrderedDict()  # key -> (stored_at, results), oldest first
+        self.hits = 0
+        self.misses = 0
+        if path:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            print(f"Ignoring unreadable lookup cache {self.path}: {e}")
+            return
+        now = time.time()
+        for key, stored_at, results in saved[-self.max_entries:]:
+            if now - stored_at < self.ttl:
+                self.entries[key] = (stored_at, results)
+
+    def get(self, kind, term):
+        """Return cached results, or None if absent or expired. Callers must not mutate them."""
+        key = f"{kind}:{normalize_term(term)}"
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.time() - entry[0] < self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, kind, term, results):
+        key = f"{kind}:{normalize_term(term)}"
+        with self.lock:
+            self.entries[key] = (time.time(), results)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            if self.path and self.save_delay and self.save_timer is None:
+                self.save_timer = threading.Timer(self.save_delay, self._save_later)
+                self.save_timer.daemon = True
+                self.save_timer.start()
+
+    def _save_later(self):
+        try:
+            self.save()
+        except OSError as e:
+            print(f"Could not save lookup cache {self.path}: {e}")
+
+    def save(self):
+        """Write unexpired entries to disk atomically (no-op without a path)"""
+        if not self.path:
+            return
+        with self.save_lock:
+            with self.lock:
+                if self.save_timer is not None:
+                    self.save_timer.cancel()
+                    self.save_timer = None
+                now = time.time()
+                saved = [[key, stored_at, results] for key, (stored_at, results) in self.entries.items()
+                         if now - stored_at < self.ttl]
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(saved, f)
+            os.replace(tmp_path, self.path)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.entries),
+            }
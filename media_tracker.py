@@ -1,13 +1,25 @@
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, jsonify, request, send_from_directory
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-import requests
-import pandas as pd
 import os
 import threading
 import re
 import queue
-from dotenv import load_dotenv
-from rapidfuzz import fuzz
+import atexit
+import functools
+import uuid
+from datetime import datetime, timezone
+from library_store import COLUMNS
+from library_sync import sync_sources
+from http_client import coalesce, single_flight
+from scan_jobs import ScanJobs
+from events import EventBroker
+import fast_json
+import config
+from config import (
+    RADARR_URL, SONARR_URL, SERIAL_PORT, SERIAL_BAUDRATE,
+    radarr, sonarr, upcitemdb, LIBRARY_SOURCES
+)
 
 try:
     import serial
@@ -18,158 +30,90 @@ except ImportError:
     print("Warning: pyserial not available. Serial port scanning disabled.")
 
 # ================= CONFIG =================
-load_dotenv()
+# Shared settings live in config.py; these only apply to the web app
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "4"))  # concurrent async scans/lookups
+SYNC_ON_STARTUP = os.getenv("SYNC_ON_STARTUP", "1") == "1"
+ADD_SHUTDOWN_WAIT_SECONDS = float(os.getenv("ADD_SHUTDOWN_WAIT_SECONDS", "8"))  # within docker stop's 10 s grace
 
-RADARR_URL = os.getenv("RADARR_URL", "http://192.168.1.10:7878")
-RADARR_API_KEY = os.getenv("RADARR_API_KEY")
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify() through fast_json: orjson when installed, numpy scalars native, NaN as null"""
 
-SONARR_URL = os.getenv("SONARR_URL", "http://192.168.1.10:8989")
-SONARR_API_KEY = os.getenv("SONARR_API_KEY")
+    def dumps(self, obj, **kwargs):
+        return fast_json.dumps(obj).decode('utf-8')
 
-MOVIE_ROOT = os.getenv("MOVIE_ROOT", "/movies")
-TV_ROOT = os.getenv("TV_ROOT", "/tv")
+    def loads(self, s, **kwargs):
+        return fast_json.loads(s)
 
-CSV_FILE = "media_library.csv"
-SERIAL_PORT = os.getenv("SERIAL_PORT", None)  # e.g., "COM3" on Windows, "/dev/ttyUSB0" on Linux
-SERIAL_BAUDRATE = int(os.getenv("SERIAL_BAUDRATE", "115200"))
-
-HEADERS_RADARR = {"X-Api-Key": RADARR_API_KEY}
-HEADERS_SONARR = {"X-Api-Key": SONARR_API_KEY}
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(fast_json.dumps(obj), mimetype=self.mimetype)
 
 app = Flask(__name__)
-CORS(app)  # Enable CORS for React frontend
+app.json = FastJSONProvider(app)
+CORS(app, expose_headers=['ETag', 'Last-Modified'])  # Enable CORS for React frontend
 
 # Serial port barcode queue
 barcode_queue = queue.Queue()
 serial_thread = None
 
+# Shared in-memory library (routes and background threads all use this)
+store = config.open_store()
+sync_state = config.open_sync_state()
+upc_cache = config.open_upc_cache()
+lookup_cache = config.open_lookup_cache()
+atexit.register(store.close)
+atexit.register(lookup_cache.save)
+radarr_metadata, sonarr_metadata = config.arr_metadata()
+# Live updates for /api/events subscribers
+broker = EventBroker()
+add_queue = config.open_add_queue(listener=lambda item: broker.publish('add', item))
+
+def drain_add_queue():
+    """At shutdown, let queued adds reach Radarr/Sonarr and report any that didn't"""
+    if add_queue.wait(timeout=ADD_SHUTDOWN_WAIT_SECONDS):
+        return
+    for item in add_queue.unfinished():
+        print(f"Not added before shutdown ({item['status']}): {item['type']} \"{item['title']}\"")
 
-# =============== HELPERS ==================
-
-def load_or_create_db():
-    if os.path.exists(CSV_FILE):
-        print(f"Loading database from {CSV_FILE}")
-        df = pd.read_csv(CSV_FILE)
-        # Ensure genres column exists (for backward compatibility)
-        if 'genres' not in df.columns:
-            df['genres'] = ''
-        # Fill NaN values in genres column
-        df['genres'] = df['genres'].fillna('')
-        return df
-    print("Creating new database")
-    return pd.DataFrame(columns=[
-        "type", "title", "year",
-        "tmdb_id", "tvdb_id",
-        "season_count",
-        "has_physical", "barcode",
-        "source", "genres"
-    ])
-
-def save_db(df):
-    df.to_csv(CSV_FILE, index=False)
-
-# ========== IMPORT FROM RADARR ============
-
-def import_radarr(df):
-    try:
-        r = requests.get(f"{RADARR_URL}/api/v3/movie", headers=HEADERS_RADARR)
-        r.raise_for_status()
+atexit.register(drain_add_queue)
 
-        rows = []
-        
-        for m in r.json():
-            # Extract genres from Radarr response
-            genres_list = m.get("genres", [])
-            genres_str = ", ".join(genres_list) if genres_list else ""
-            # Check if movie exists
-            existing = df[(df["title"] == m["title"]) & (df["type"] == "movie")]
-            
-            if existing.empty:
-                # Add new movie
-                rows.append({
-                    "type": "movie",
-                    "title": m["title"],
-                    "year": m["year"],
-                    "tmdb_id": m["tmdbId"],
-                    "tvdb_id": None,
-                    "season_count": None,
-                    "has_physical": False,
-                    "barcode": None,
-                    "source": "radarr",
-                    "genres": genres_str
-                })
-            else:
-                # Update existing movie with genres if missing
-                idx = existing.index[0]
-                if pd.isna(df.loc[idx, 'genres']) or df.loc[idx, 'genres'] == '':
-                    df.loc[idx, 'genres'] = genres_str
-
-        if rows:
-            return pd.concat([df, pd.DataFrame(rows)], ignore_index=True)
-        return df
-    except Exception as e:
-        print(f"Error importing from Radarr: {e}")
-        return df
+scan_jobs = ScanJobs(workers=SCAN_WORKERS, listener=lambda job: broker.publish(job['kind'], job))
 
+# ========== IMPORT FROM RADARR/SONARR ======
 
-# ========== IMPORT FROM SONARR ============
+# One sync at a time (the startup sync may still be running when /api/sync is called)
+sync_lock = threading.Lock()
 
-def import_sonarr(df):
-    try:
-        r = requests.get(f"{SONARR_URL}/api/v3/series", headers=HEADERS_SONARR)
-        r.raise_for_status()
-
-        rows = []
-        for s in r.json():
-            # Extract genres from Sonarr response
-            genres_list = s.get("genres", [])
-            genres_str = ", ".join(genres_list) if genres_list else ""
-            
-            # Check if series exists
-            existing = df[(df["title"] == s["title"]) & (df["type"] == "series")]
-            
-            if existing.empty:
-                # Add new series
-                rows.append({
-                    "type": "series",
-                    "title": s["title"],
-                    "year": s["year"],
-                    "tmdb_id": None,
-                    "tvdb_id": s["tvdbId"],
-                    "season_count": len(s["seasons"]),
-                    "has_physical": False,
-                    "barcode": None,
-                    "source": "sonarr",
-                    "genres": genres_str
-                })
-            else:
-                # Update existing series with genres if missing
-                idx = existing.index[0]
-                if pd.isna(df.loc[idx, 'genres']) or df.loc[idx, 'genres'] == '':
-                    df.loc[idx, 'genres'] = genres_str
-
-        if rows:
-            return pd.concat([df, pd.DataFrame(rows)], ignore_index=True)
-        return df
-    except Exception as e:
-        print(f"Error importing from Sonarr: {e}")
-        return df
+def import_libraries(incremental=True):
+    """Fetch Radarr and Sonarr concurrently and merge both into the library in one write"""
+    with sync_lock:
+        result = sync_sources(store, sync_state, LIBRARY_SOURCES, incremental)
+    counts = result['counts']
+    print(f"Library sync: {counts['added']} added, {counts['updated']} updated, "
+          f"{counts['removed']} removed, {counts['unchanged']} unchanged")
+    return result
 
 
 # ========== BARCODE LOOKUP ================
 
+@coalesce('upc')
 def lookup_barcode(barcode):
+    cached, title = upc_cache.get(barcode)
+    if cached:
+        return title
     try:
-        r = requests.get(
+        r = upcitemdb.get(
             "https://api.upcitemdb.com/prod/trial/lookup",
             params={"upc": barcode}
         )
         data = r.json()
 
-        if data.get("code") != "OK" or not data["items"]:
+        if data.get("code") != "OK":
             return None
 
-        return data["items"][0]["title"]
+        title = data["items"][0]["title"] if data.get("items") else None
+        upc_cache.put(barcode, title)
+        return title
     except Exception as e:
         print(f"Error looking up barcode: {e}")
         return None
@@ -204,118 +148,137 @@ def extract_base_title(title):
 
 def search_local_database(query, media_type=None, year=None):
     """Search local database with fuzzy matching"""
-    df = load_or_create_db()
-    results = []
-    
     if not query:
-        return results
+        return []
     
     base_query = extract_base_title(query).lower()
     
-    # Filter by type if specified
-    if media_type:
-        df_filtered = df[df['type'] == media_type]
-    else:
-        df_filtered = df
-    
-    for idx, row in df_filtered.iterrows():
-        title = str(row['title']).lower() if pd.notna(row['title']) else ""
-        
-        # Calculate similarity
-        similarity = fuzz.ratio(base_query, title)
-        
-        # Also check if base query is contained in title
-        contains_match = base_query in title or title in base_query
-        
-        # Match by year if provided
-        year_match = True
-        if year and pd.notna(row['year']):
-            year_match = abs(int(row['year']) - int(year)) <= 2  # Allow 2 year difference
-        
-        # Add to results if similarity is high enough or contains match
-        if similarity >= 80 or (contains_match and similarity >= 60):
-            if year is None or year_match:
-                result = row.to_dict()
-                # Convert NaN values to None for JSON serialization
-                for key, value in result.items():
-                    if pd.isna(value):
-                        result[key] = None
-                result['similarity'] = similarity
-                result['match_type'] = 'local'
-                results.append(result)
+    # Score every title in one batched call, then build dicts for the top hits only
+    with store.lock:
+        matches = store.title_index().match(base_query, media_type, year, limit=10)
+        df = store.frame()
+        hits = df.loc[[label for label, _ in matches]]
+    # Missing values as None (one vectorized pass) so ids compare and serialize cleanly
+    rows = hits.astype(object).where(hits.notna(), None).to_dict('records')
     
-    # Sort by similarity (highest first)
-    results.sort(key=lambda x: x.get('similarity', 0), reverse=True)
+    results = []
+    for result, (_, similarity) in zip(rows, matches):
+        result['similarity'] = similarity
+        result['match_type'] = 'local'
+        results.append(result)
     
-    return results[:10]  # Return top 10 matches
+    return results
+
+def mark_physical_copy(match, barcode):
+    """Set has_physical and barcode on the library row for a local search match.
+    Returns the updated row, or None if the row no longer exists."""
+    with store.lock:
+        idx = store.find_external(match['type'], match.get('tmdb_id'), match.get('tvdb_id'))
+        if idx is None:
+            df = store.frame()
+            existing = df[(df['type'] == match['type']) & (df['title'] == match['title'])]
+            if existing.empty:
+                return None
+            idx = existing.index[0]
+        return store.update(idx, {'has_physical': True, 'barcode': barcode})
 
 
 # ========== SEARCH TMDB ===================
 
+# Cached results are shared; coalesce hands every caller its own copy
+
+@coalesce('radarr/movie/lookup')
 def search_tmdb_movie(title):
+    results = lookup_cache.get('movie', title)
+    if results is not None:
+        return results
     try:
-        r = requests.get(
+        r = radarr.get(
             f"{RADARR_URL}/api/v3/movie/lookup",
-            headers=HEADERS_RADARR,
             params={"term": title}
         )
-        results = r.json()
-        return results if results else []
+        r.raise_for_status()
+        results = r.json() or []
     except Exception as e:
         print(f"Error searching TMDB: {e}")
         return []
+    lookup_cache.put('movie', title, results)
+    return results
 
+@coalesce('sonarr/series/lookup')
 def search_tvdb_series(title):
+    results = lookup_cache.get('series', title)
+    if results is not None:
+        return results
     try:
-        r = requests.get(
+        r = sonarr.get(
             f"{SONARR_URL}/api/v3/series/lookup",
-            headers=HEADERS_SONARR,
             params={"term": title}
         )
-        results = r.json()
-        return results if results else []
+        r.raise_for_status()
+        results = r.json() or []
     except Exception as e:
         print(f"Error searching TVDB: {e}")
         return []
+    lookup_cache.put('series', title, results)
+    return results
+
+# ========== RESULT SHAPING ================
+
+# Lookup fields the UI and /api/confirm use; the rest (images, ratings,
+# alternate titles, ...) is only sent when a client asks for full=true
+COMPACT_FIELDS = {
+    'movie': ('tmdbId', 'imdbId', 'title', 'year', 'overview', 'runtime', 'studio',
+              'genres', 'remotePoster', 'already_in_library'),
+    'series': ('tvdbId', 'imdbId', 'title', 'year', 'overview', 'runtime', 'network',
+               'genres', 'remotePoster', 'already_in_library'),
+}
+
+def compact_result(item, media_type):
+    """Trim a Radarr/Sonarr lookup result to the compact schema"""
+    result = {key: item[key] for key in COMPACT_FIELDS[media_type] if key in item}
+    if media_type == 'series':
+        # confirm_add derives season_count from this list
+        result['seasons'] = [{'seasonNumber': s.get('seasonNumber')} for s in item.get('seasons') or []]
+    return result
+
+def shape_results(results, media_type, full=False):
+    """First 10 external results, compacted unless full is set"""
+    results = results[:10]
+    return results if full else [compact_result(r, media_type) for r in results]
+
+def wants_full(data):
+    """True if the client asked for complete lookup objects ({"full": true} or ?full=true)"""
+    return bool(data.get('full')) or request.args.get('full') in ('1', 'true')
 
 # ========== ADD TO RADARR =================
 
 def add_movie(movie):
-    try:
-        payload = {
-            "tmdbId": movie["tmdbId"],
-            "title": movie["title"],
-            "year": movie["year"],
-            "qualityProfileId": 1,
-            "rootFolderPath": MOVIE_ROOT,
-            "monitored": True,
-            "addOptions": {"searchForMovie": False}
-        }
-        requests.post(f"{RADARR_URL}/api/v3/movie", json=payload, headers=HEADERS_RADARR)
-        return True
-    except Exception as e:
-        print(f"Error adding movie to Radarr: {e}")
-        return False
+    """Queue a movie for adding to Radarr; returns its add queue status"""
+    payload = {
+        "tmdbId": movie["tmdbId"],
+        "title": movie["title"],
+        "year": movie["year"],
+        **radarr_metadata.add_options(),
+        "monitored": True,
+        "addOptions": {"searchForMovie": False}
+    }
+    return add_queue.put('movie', payload)
 
 
 # ========== ADD TO SONARR =================
 
 def add_series(series):
-    try:
-        payload = {
-            "tvdbId": series["tvdbId"],
-            "title": series["title"],
-            "year": series["year"],
-            "qualityProfileId": 1,
-            "rootFolderPath": TV_ROOT,
-            "monitored": True,
-            "addOptions": {"searchForMissingEpisodes": False}
-        }
-        requests.post(f"{SONARR_URL}/api/v3/series", json=payload, headers=HEADERS_SONARR)
-        return True
-    except Exception as e:
-        print(f"Error adding series to Sonarr: {e}")
-        return False
+    """Queue a series for adding to Sonarr; returns its add queue status"""
+    payload = {
+        "tvdbId": series["tvdbId"],
+        "title": series["title"],
+        "year": series["year"],
+        **sonarr_metadata.add_options(),
+        "monitored": True,
+        "addOptions": {"searchForMissingEpisodes": False}
+    }
+    return add_queue.put('series', payload)
 
 # ============ WEB ROUTES ==================
 
@@ -326,37 +289,140 @@ def index():
 
 # ============ API ROUTES ==================
 
+# Distinguishes library versions of this process from those of earlier runs
+BOOT_ID = uuid.uuid4().hex[:8]
+
+def conditional(view):
+    """Tag responses with the library version and answer 304 when the client's copy is current.
+
+    The view only runs when the client has no copy or an outdated one.
+    Only the ETag is validated: Last-Modified has one-second resolution and
+    would hide a second write within the same second.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with store.lock:
+            store.frame()  # pick up changes made by other processes
+            version, modified = store.version, store.modified
+        etag = f"{BOOT_ID}-{version}"
+        last_modified = datetime.fromtimestamp(int(modified), timezone.utc)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            response.last_modified = last_modified
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return wrapper
+
+def library_stats():
+    """Movie, series and physical copy counts (maintained incrementally by the store)"""
+    return store.stats()
+
 @app.route('/api/stats', methods=['GET'])
+@conditional
 def get_stats():
     """Get current statistics"""
-    df = load_or_create_db()
+    return jsonify(library_stats())
 
-    stats = {
-        'movies': int(df[df['type'] == 'movie'].shape[0]),
-        'series': int(df[df['type'] == 'series'].shape[0]),
-        'dvds': int(df[df['has_physical'] == True].shape[0])
-    }
 
-    return jsonify(stats)
+# /api/media page size when no limit is given, and the largest limit accepted
+MEDIA_PAGE_SIZE = 100
+MEDIA_MAX_PAGE_SIZE = 1000
 
+def _int_arg(name, default=None, minimum=None):
+    value = request.args.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer")
+    if minimum is not None and value < minimum:
+        raise ValueError(f"{name} must be at least {minimum}")
+    return value
 
 @app.route('/api/media', methods=['GET'])
+@conditional
 def get_media():
-    """Get all media items"""
-    df = load_or_create_db()
-    return jsonify(df.to_dict('records'))
+    """Get a page of media items.
 
-@app.route('/api/scan', methods=['POST'])
-def scan():
-    """Fast scan endpoint - checks barcode first, then local DB, returns immediately"""
-    data = request.json
-    barcode = data.get('barcode', '').strip()
+    Query parameters: type, has_physical (true/false), year_min, year_max,
+    genre, source, fields (comma-separated columns), offset and limit.
+    """
+    args = request.args
+    try:
+        offset = _int_arg('offset', 0, minimum=0)
+        limit = min(_int_arg('limit', MEDIA_PAGE_SIZE, minimum=1), MEDIA_MAX_PAGE_SIZE)
+        year_min = _int_arg('year_min')
+        year_max = _int_arg('year_max')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    fields = None
+    if args.get('fields'):
+        fields = [f.strip() for f in args['fields'].split(',') if f.strip()]
+        unknown = [f for f in fields if f not in COLUMNS]
+        if unknown:
+            return jsonify({'error': f"Unknown fields: {', '.join(unknown)}"}), 400
+
+    has_physical = args.get('has_physical')
+    if has_physical is not None:
+        has_physical = has_physical.strip().lower() in ('true', '1', 'yes')
+
+    total, items = store.query(
+        media_type=args.get('type'),
+        has_physical=has_physical,
+        year_min=year_min,
+        year_max=year_max,
+        genre=args.get('genre'),
+        source=args.get('source'),
+        fields=fields,
+        offset=offset,
+        limit=limit
+    )
+    next_offset = offset + len(items)
+    return jsonify({
+        'items': items,
+        'total': total,
+        'offset': offset,
+        'limit': limit,
+        'next_offset': next_offset if next_offset < total else None
+    })
 
-    if not barcode:
-        return jsonify({'error': 'No barcode provided'}), 400
+EXPORT_CHUNK_SIZE = 500
+
+def export_ndjson():
+    """One JSON object per line, generated a chunk at a time"""
+    for chunk in store.iter_chunks(EXPORT_CHUNK_SIZE):
+        yield b''.join(fast_json.dumps(record) + b'\n' for record in chunk.to_dict('records'))
+
+def export_csv():
+    """CSV with a header row, generated a chunk at a time"""
+    yield ','.join(COLUMNS) + '\n'
+    for chunk in store.iter_chunks(EXPORT_CHUNK_SIZE):
+        yield chunk.to_csv(header=False, index=False, columns=COLUMNS)
+
+@app.route('/api/export', methods=['GET'])
+def export_library():
+    """Stream the whole library as NDJSON (default) or CSV (?format=csv)"""
+    export_format = request.args.get('format', 'ndjson')
+    if export_format == 'ndjson':
+        body, mimetype = export_ndjson(), 'application/x-ndjson'
+    elif export_format == 'csv':
+        body, mimetype = export_csv(), 'text/csv'
+    else:
+        return jsonify({'error': 'format must be ndjson or csv'}), 400
+    return Response(body, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename=media_library.{export_format}',
+        'X-Accel-Buffering': 'no'
+    })
 
-    df = load_or_create_db()
-    steps = []
+def run_scan(steps, barcode):
+    """Scan pipeline: check barcode, UPC lookup, local search. Returns (result, http status)."""
     result_data = {
         'barcode': barcode,
         'steps': steps
@@ -364,15 +430,13 @@ def scan():
 
     # Step 1: Check if barcode already exists in database
     steps.append({'step': 1, 'action': 'Check barcode in database', 'status': 'checking'})
-    barcode_matches = df[df['barcode'].astype(str) == str(barcode)]
-    if not barcode_matches.empty:
-        # Toggle has_physical
-        idx = barcode_matches.index[0]
-        old_physical = df.loc[idx, 'has_physical']
-        df.loc[idx, 'has_physical'] = not df.loc[idx, 'has_physical']
-        save_db(df)
-        
-        item = df.loc[idx].to_dict()
+    with store.lock:
+        idx = store.find_barcode(barcode)
+        if idx is not None:
+            # Toggle has_physical
+            old_physical = store.frame().loc[idx, 'has_physical']
+            item = store.update(idx, {'has_physical': not old_physical})
+    if idx is not None:
         steps.append({
             'step': 1, 
             'action': 'Check barcode in database', 
@@ -388,7 +452,7 @@ def scan():
             'toggled': True,
             'found_by_barcode': True
         })
-        return jsonify(result_data)
+        return result_data, 200
 
     steps.append({
         'step': 1, 
@@ -411,7 +475,7 @@ def scan():
             'success': False,
             'error': 'Barcode not found in lookup database'
         })
-        return jsonify(result_data), 404
+        return result_data, 404
 
     steps.append({
         'step': 2, 
@@ -443,22 +507,8 @@ def scan():
         })
         
         # Found in local database - update the first match
-        best_match = local_results[0]
-        # Find the row in dataframe
-        if 'tmdb_id' in best_match and pd.notna(best_match['tmdb_id']):
-            existing = df[(df['type'] == best_match['type']) & (df['tmdb_id'] == best_match['tmdb_id'])]
-        elif 'tvdb_id' in best_match and pd.notna(best_match['tvdb_id']):
-            existing = df[(df['type'] == best_match['type']) & (df['tvdb_id'] == best_match['tvdb_id'])]
-        else:
-            existing = df[(df['type'] == best_match['type']) & (df['title'] == best_match['title'])]
-        
-        if not existing.empty:
-            idx = existing.index[0]
-            df.loc[idx, 'has_physical'] = True
-            df.loc[idx, 'barcode'] = barcode
-            save_db(df)
-            
-            item = df.loc[idx].to_dict()
+        item = mark_physical_copy(local_results[0], barcode)
+        if item is not None:
             steps.append({
                 'step': 5, 
                 'action': 'Update database', 
@@ -473,7 +523,7 @@ def scan():
                 'found_in_local': True,
                 'local_results': local_results[:10]
             })
-            return jsonify(result_data)
+            return result_data, 200
     else:
         steps.append({
             'step': 4, 
@@ -499,26 +549,56 @@ def scan():
         'found_in_local': False,
         'message': 'Item not found in local database. Please use /api/lookup for external search.'
     })
-    return jsonify(result_data)
+    return result_data, 200
 
-@app.route('/api/lookup', methods=['POST'])
-def lookup():
-    """Lookup barcode and search for matches - searches local DB first, then external"""
+def wants_async(data):
+    """True if the client asked for a background job ({"async": true} or ?async=1)"""
+    return bool(data.get('async')) or request.args.get('async') in ('1', 'true')
+
+def job_accepted(job):
+    return jsonify({
+        'job_id': job['id'],
+        'status': job['status'],
+        'poll': f"/api/jobs/{job['id']}"
+    }), 202
+
+@app.route('/api/scan', methods=['POST'])
+def scan():
+    """Fast scan endpoint - checks barcode first, then local DB (async mode returns a job id)"""
     data = request.json
     barcode = data.get('barcode', '').strip()
 
     if not barcode:
         return jsonify({'error': 'No barcode provided'}), 400
 
-    df = load_or_create_db()
+    if wants_async(data):
+        return job_accepted(scan_jobs.submit('scan', run_scan, barcode))
+    result, status = run_scan([], barcode)
+    broker.publish('scan', {'id': None, 'kind': 'scan', 'status': 'done', 'result': result, 'http_status': status})
+    return jsonify(result), status
+
+def run_lookup(steps, barcode, full=False):
+    """Lookup pipeline: UPC lookup, local search, then TMDB/TVDB. Returns (result, http status).
 
+    External results are compacted unless full is set.
+    """
     # Check if already scanned
-    if barcode in df['barcode'].values:
-        return jsonify({'error': 'Barcode already scanned'}), 400
+    steps.append({'step': 1, 'action': 'Check barcode in database', 'status': 'checking'})
+    if store.find_barcode(barcode) is not None:
+        steps.append({'step': 1, 'action': 'Check barcode in database', 'status': 'found'})
+        return {'error': 'Barcode already scanned'}, 400
+    steps.append({'step': 1, 'action': 'Check barcode in database', 'status': 'not_found'})
 
     # Lookup barcode
+    steps.append({'step': 2, 'action': 'Lookup barcode in UPC database', 'status': 'checking'})
     title = lookup_barcode(barcode)
     suggested_title = title if title else ""
+    steps.append({
+        'step': 2,
+        'action': 'Lookup barcode in UPC database',
+        'status': 'found' if title else 'not_found',
+        'details': f"Found title: {title}" if title else 'Barcode not found in UPC lookup database'
+    })
     
     # Guess type
     media_type = guess_type(suggested_title) if suggested_title else "movie"
@@ -526,37 +606,65 @@ def lookup():
     # Search local database first
     local_results = []
     if suggested_title:
+        steps.append({'step': 3, 'action': 'Search local database', 'status': 'searching'})
         base_title = extract_base_title(suggested_title)
         local_results = search_local_database(base_title, media_type)
+        steps.append({
+            'step': 3,
+            'action': 'Search local database',
+            'status': 'found' if local_results else 'not_found',
+            'details': f"Found {len(local_results)} match(es) in local database"
+        })
     
     # Search external databases
     movie_results = []
     series_results = []
     
     if suggested_title:
+        source = 'TMDB' if media_type == "movie" else 'TVDB'
+        steps.append({'step': 4, 'action': f'Search {source}', 'status': 'searching'})
         if media_type == "movie":
             movie_results = search_tmdb_movie(suggested_title)
             # Mark if already in library
             for result in movie_results:
-                existing = df[(df['type'] == 'movie') & (df['tmdb_id'] == result['tmdbId'])]
-                if not existing.empty:
+                if store.find_external('movie', tmdb_id=result.get('tmdbId')) is not None:
                     result['already_in_library'] = True
         else:
             series_results = search_tvdb_series(suggested_title)
             # Mark if already in library
             for result in series_results:
-                existing = df[(df['type'] == 'series') & (df['tvdb_id'] == result['tvdbId'])]
-                if not existing.empty:
+                if store.find_external('series', tvdb_id=result.get('tvdbId')) is not None:
                     result['already_in_library'] = True
+        found = len(movie_results) + len(series_results)
+        steps.append({
+            'step': 4,
+            'action': f'Search {source}',
+            'status': 'found' if found else 'not_found',
+            'details': f"Found {found} result(s)"
+        })
     
-    return jsonify({
+    return {
         'barcode': barcode,
         'suggested_title': suggested_title,
         'suggested_type': media_type,
         'local_results': local_results,
-        'movie_results': movie_results[:10],
-        'series_results': series_results[:10]
-    })
+        'movie_results': shape_results(movie_results, 'movie', full),
+        'series_results': shape_results(series_results, 'series', full)
+    }, 200
+
+@app.route('/api/lookup', methods=['POST'])
+def lookup():
+    """Lookup barcode and search for matches - searches local DB first, then external"""
+    data = request.json
+    barcode = data.get('barcode', '').strip()
+
+    if not barcode:
+        return jsonify({'error': 'No barcode provided'}), 400
+
+    if wants_async(data):
+        return job_accepted(scan_jobs.submit('lookup', run_lookup, barcode, wants_full(data)))
+    result, status = run_lookup([], barcode, wants_full(data))
+    return jsonify(result), status
 
 @app.route('/api/search', methods=['POST'])
 def search():
@@ -579,7 +687,8 @@ def search():
     
     return jsonify({
         'local_results': local_results,
-        'external_results': external_results[:10],
+        'external_results': shape_results(external_results, 'movie' if media_type == 'movie' else 'series',
+                                          wants_full(data)),
         'type': media_type
     })
 
@@ -594,159 +703,202 @@ def confirm_add():
     if not barcode or not media_type or not selected_item:
         return jsonify({'error': 'Missing required data'}), 400
     
-    df = load_or_create_db()
-    
-    # Check if already scanned with this barcode
-    if barcode in df['barcode'].values:
-        return jsonify({'error': 'Barcode already scanned'}), 400
+    # Hold the lock from the barcode check to the write so concurrent confirms
+    # (or a scan job) can't both insert the same barcode
+    with store.lock:
+        # Check if already scanned with this barcode
+        if store.find_barcode(barcode) is not None:
+            return jsonify({'error': 'Barcode already scanned'}), 400
     
-    if media_type == 'movie':
-        # Check if movie already exists in library
-        existing = df[(df['type'] == 'movie') & (df['tmdb_id'] == selected_item['tmdbId'])]
+        if media_type == 'movie':
+            # Check if movie already exists in library
+            idx = store.find_external('movie', tmdb_id=selected_item['tmdbId'])
+            item = None
+            if idx is not None:
+                # Update existing entry to mark as physical
+                item = store.update(idx, {'has_physical': True, 'barcode': barcode})
         
-        if not existing.empty:
-            # Update existing entry to mark as physical
-            df.loc[existing.index, 'has_physical'] = True
-            df.loc[existing.index, 'barcode'] = barcode
-            save_db(df)
-            
-            return jsonify({
-                'success': True,
-                'item': df.loc[existing.index].iloc[0].to_dict(),
-                'updated': True
-            })
-        else:
-            # Add to Radarr
-            add_movie(selected_item)
+            if item is not None:
+                return jsonify({
+                    'success': True,
+                    'item': item,
+                    'updated': True
+                })
+            else:
+                # Add to database
+                # Get genres from selected item if available
+                genres_list = selected_item.get("genres", [])
+                genres_str = ", ".join([g.get("name", g) if isinstance(g, dict) else g for g in genres_list]) if genres_list else ""
             
-            # Add to database
-            # Get genres from selected item if available
-            genres_list = selected_item.get("genres", [])
-            genres_str = ", ".join([g.get("name", g) if isinstance(g, dict) else g for g in genres_list]) if genres_list else ""
+                new_row = {
+                    "type": "movie",
+                    "title": selected_item["title"],
+                    "year": selected_item.get("year"),
+                    "tmdb_id": selected_item["tmdbId"],
+                    "tvdb_id": None,
+                    "season_count": None,
+                    "has_physical": True,
+                    "barcode": barcode,
+                    "source": "barcode",
+                    "genres": genres_str
+                }
             
-            new_row = {
-                "type": "movie",
-                "title": selected_item["title"],
-                "year": selected_item.get("year"),
-                "tmdb_id": selected_item["tmdbId"],
-                "tvdb_id": None,
-                "season_count": None,
-                "has_physical": True,
-                "barcode": barcode,
-                "source": "barcode",
-                "genres": genres_str
-            }
+                store.append([new_row])
             
-            df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-            save_db(df)
+                # Queue for Radarr; the add happens in the background
+                add_job = add_movie(selected_item)
             
-            return jsonify({
-                'success': True,
-                'item': new_row,
-                'updated': False
-            })
+                return jsonify({
+                    'success': True,
+                    'item': new_row,
+                    'updated': False,
+                    'add_job': add_job
+                })
     
-    else:  # series
-        # Check if series already exists in library
-        existing = df[(df['type'] == 'series') & (df['tvdb_id'] == selected_item['tvdbId'])]
+        else:  # series
+            # Check if series already exists in library
+            idx = store.find_external('series', tvdb_id=selected_item['tvdbId'])
+            item = None
+            if idx is not None:
+                # Update existing entry to mark as physical
+                item = store.update(idx, {'has_physical': True, 'barcode': barcode})
         
-        if not existing.empty:
-            # Update existing entry to mark as physical
-            df.loc[existing.index, 'has_physical'] = True
-            df.loc[existing.index, 'barcode'] = barcode
-            save_db(df)
-            
-            return jsonify({
-                'success': True,
-                'item': df.loc[existing.index].iloc[0].to_dict(),
-                'updated': True
-            })
-        else:
-            # Add to Sonarr
-            add_series(selected_item)
+            if item is not None:
+                return jsonify({
+                    'success': True,
+                    'item': item,
+                    'updated': True
+                })
+            else:
+                # Add to database
+                # Get genres from selected item if available
+                genres_list = selected_item.get("genres", [])
+                genres_str = ", ".join([g.get("name", g) if isinstance(g, dict) else g for g in genres_list]) if genres_list else ""
             
-            # Add to database
-            # Get genres from selected item if available
-            genres_list = selected_item.get("genres", [])
-            genres_str = ", ".join([g.get("name", g) if isinstance(g, dict) else g for g in genres_list]) if genres_list else ""
+                new_row = {
+                    "type": "series",
+                    "title": selected_item["title"],
+                    "year": selected_item.get("year"),
+                    "tmdb_id": None,
+                    "tvdb_id": selected_item["tvdbId"],
+                    "season_count": len(selected_item.get("seasons", [])),
+                    "has_physical": True,
+                    "barcode": barcode,
+                    "source": "barcode",
+                    "genres": genres_str
+                }
             
-            new_row = {
-                "type": "series",
-                "title": selected_item["title"],
-                "year": selected_item.get("year"),
-                "tmdb_id": None,
-                "tvdb_id": selected_item["tvdbId"],
-                "season_count": len(selected_item.get("seasons", [])),
-                "has_physical": True,
-                "barcode": barcode,
-                "source": "barcode",
-                "genres": genres_str
-            }
+                store.append([new_row])
             
-            df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-            save_db(df)
+                # Queue for Sonarr; the add happens in the background
+                add_job = add_series(selected_item)
             
-            return jsonify({
-                'success': True,
-                'item': new_row,
-                'updated': False
-            })
+                return jsonify({
+                    'success': True,
+                    'item': new_row,
+                    'updated': False,
+                    'add_job': add_job
+                })
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Progress of an async scan or lookup: status, steps so far and, once done, the result"""
+    job = scan_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job)
+
+
+@app.route('/api/add-queue', methods=['GET'])
+def get_add_queue():
+    """Status of titles queued for adding to Radarr/Sonarr, newest first"""
+    return jsonify(add_queue.snapshot())
+
+
+@app.route('/api/add-queue/<item_id>', methods=['GET'])
+def get_add_queue_item(item_id):
+    """Status of one queued add"""
+    status = add_queue.status(item_id)
+    if status is None:
+        return jsonify({'error': 'Unknown add job'}), 404
+    return jsonify(status)
 
 
 @app.route('/api/sync', methods=['POST'])
 def sync_libraries():
-    """Sync with Radarr and Sonarr"""
-    df = load_or_create_db()
-    df = import_radarr(df)
-    df = import_sonarr(df)
-    save_db(df)
+    """Sync with Radarr and Sonarr (only changed items unless {"mode": "full"} is posted)"""
+    data = request.get_json(silent=True) or {}
+    incremental = data.get('mode', 'incremental') != 'full'
+    result = import_libraries(incremental)
 
-    return jsonify({'success': True, 'total_items': len(df)})
+    return jsonify({
+        'success': True,
+        'total_items': len(store.frame()),
+        **result
+    })
+
+@app.route('/api/cache-stats', methods=['GET'])
+def get_cache_stats():
+    """Get hit/miss counters for the external lookup caches"""
+    return jsonify({
+        'upc': upc_cache.stats(),
+        'lookup': lookup_cache.stats(),
+        'radarr_metadata': radarr_metadata.summary(),
+        'sonarr_metadata': sonarr_metadata.summary(),
+        'coalesced_requests': single_flight.shared
+    })
+
+def genre_stats():
+    """Genre counts for movies, series and both (maintained incrementally by the store)"""
+    return store.genre_stats()
 
 @app.route('/api/genre-stats', methods=['GET'])
+@conditional
 def get_genre_stats():
     """Get genre statistics for movies and TV shows"""
-    df = load_or_create_db()
-    
-    # Ensure genres column exists
-    if 'genres' not in df.columns:
-        return jsonify({
-            'movies': {},
-            'series': {},
-            'all': {}
-        })
-    
-    # Initialize genre counters
-    movie_genres = {}
-    series_genres = {}
-    all_genres = {}
-    
-    # Process each row
-    for idx, row in df.iterrows():
-        genres_str = str(row.get('genres', '')) if pd.notna(row.get('genres')) else ''
-        if not genres_str:
+    return jsonify(genre_stats())
+
+
+def dict_delta(old, new):
+    """Entries of new that differ from old; keys missing from new are reported as 0"""
+    delta = {key: value for key, value in new.items() if old.get(key) != value}
+    delta.update({key: 0 for key in old if key not in new})
+    return delta
+
+def publish_library_changes():
+    """Push stats and genre-count deltas to event subscribers whenever the library changes"""
+    published = None
+    last_stats, last_genres = {}, {'movies': {}, 'series': {}, 'all': {}}
+    while True:
+        # Wake on local writes; the timeout catches writes by other processes
+        store.wait_for_change(published, timeout=5)
+        store.frame()
+        version = store.version
+        if version == published:
             continue
-        
-        # Split genres (comma-separated)
-        genres_list = [g.strip() for g in genres_str.split(',') if g.strip()]
-        
-        media_type = row.get('type', '')
-        
-        for genre in genres_list:
-            # Count for all
-            all_genres[genre] = all_genres.get(genre, 0) + 1
-            
-            # Count by type
-            if media_type == 'movie':
-                movie_genres[genre] = movie_genres.get(genre, 0) + 1
-            elif media_type == 'series':
-                series_genres[genre] = series_genres.get(genre, 0) + 1
-    
-    return jsonify({
-        'movies': movie_genres,
-        'series': series_genres,
-        'all': all_genres
-    })
+        published = version
+        stats, genres = library_stats(), genre_stats()
+        delta = dict_delta(last_stats, stats)
+        if delta:
+            broker.publish('stats', delta)
+        genre_delta = {group: dict_delta(last_genres[group], genres[group]) for group in genres}
+        if any(genre_delta.values()):
+            broker.publish('genres', genre_delta)
+        last_stats, last_genres = stats, genres
+
+
+@app.route('/api/events', methods=['GET'])
+def events():
+    """Server-Sent Events: a full snapshot first, then stats/genres deltas and scan, lookup and add results"""
+    subscriber = broker.subscribe()
+    initial = [('snapshot', {'stats': library_stats(), 'genres': genre_stats()})]
+    return Response(
+        broker.stream(subscriber, initial),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 
 
 # ========== SERIAL PORT HANDLER ============
@@ -785,60 +937,48 @@ def serial_port_reader():
         if 'ser' in locals():
             ser.close()
 
+def report_serial_scan(job):
+    """Log the outcome of a serial-port scan"""
+    result = job['result'] or {}
+    barcode = result.get('barcode')
+    if job['status'] == 'error':
+        print(f"Error processing barcode: {job['error']}")
+    elif result.get('toggled'):
+        print(f"Toggled physical copy for barcode: {barcode}")
+    elif result.get('success'):
+        print(f"Updated physical copy for barcode: {barcode}")
+    else:
+        print(f"No local match for barcode: {barcode}")
+
 def process_barcode_queue():
-    """Process barcodes from the queue"""
+    """Hand barcodes from the serial port to the scan worker pool"""
     while True:
         try:
             barcode = barcode_queue.get(timeout=1)
             if barcode:
-                # Process the barcode using the scan endpoint logic
-                # This runs in a separate thread so it won't block
-                with app.app_context():
-                    try:
-                        df = load_or_create_db()
-                        
-                        # Check if barcode exists
-                        barcode_matches = df[df['barcode'].astype(str) == str(barcode)]
-                        if not barcode_matches.empty:
-                            idx = barcode_matches.index[0]
-                            df.loc[idx, 'has_physical'] = not df.loc[idx, 'has_physical']
-                            save_db(df)
-                            print(f"Toggled physical copy for barcode: {barcode}")
-                        else:
-                            # Lookup and search local DB
-                            title = lookup_barcode(barcode)
-                            if title:
-                                base_title = extract_base_title(title)
-                                local_results = search_local_database(base_title)
-                                if local_results:
-                                    best_match = local_results[0]
-                                    if 'tmdb_id' in best_match and pd.notna(best_match['tmdb_id']):
-                                        existing = df[(df['type'] == best_match['type']) & (df['tmdb_id'] == best_match['tmdb_id'])]
-                                    elif 'tvdb_id' in best_match and pd.notna(best_match['tvdb_id']):
-                                        existing = df[(df['type'] == best_match['type']) & (df['tvdb_id'] == best_match['tvdb_id'])]
-                                    else:
-                                        existing = df[(df['type'] == best_match['type']) & (df['title'] == best_match['title'])]
-                                    
-                                    if not existing.empty:
-                                        idx = existing.index[0]
-                                        df.loc[idx, 'has_physical'] = True
-                                        df.loc[idx, 'barcode'] = barcode
-                                        save_db(df)
-                                        print(f"Updated physical copy for barcode: {barcode}")
-                    except Exception as e:
-                        print(f"Error processing barcode {barcode}: {e}")
+                # Lookups run in the pool so the scanner can keep firing
+                scan_jobs.submit('scan', run_scan, barcode, on_done=report_serial_scan)
         except queue.Empty:
             continue
 
 # ============ STARTUP =====================
 
-def initialize_app():
-    """Initialize the database on startup"""
-    df = load_or_create_db()
-    df = import_radarr(df)
-    df = import_sonarr(df)
-    save_db(df)
-    print(f"Initialized with {len(df)} items")
+_startup_lock = threading.Lock()
+_started = False
+
+def sync_on_startup():
+    """Bring the library up to date with Radarr and Sonarr"""
+    try:
+        import_libraries()
+    except Exception as e:
+        print(f"Startup sync failed: {e}")
+    print(f"Initialized with {len(store.frame())} items")
+
+def start_workers():
+    """Start the background threads: profile refresh, event publisher, serial reader and barcode queue"""
+    radarr_metadata.start()
+    sonarr_metadata.start()
+    threading.Thread(target=publish_library_changes, daemon=True).start()
     
     # Start serial port handler if configured
     global serial_thread
@@ -860,11 +1000,28 @@ def initialize_app():
         if not SERIAL_PORT:
             print("Serial port not configured (set SERIAL_PORT environment variable)")
 
+def initialize_app():
+    """Start the background workers and, unless SYNC_ON_STARTUP=0, sync the library in the background.
+
+    Returns immediately so the server can listen (and WSGI workers finish
+    loading) while a long sync runs; until it finishes, requests see the
+    library as stored on disk and /api/events pushes the changes.
+    Runs once per process; later calls do nothing, so entry points can call it freely.
+    """
+    global _started
+    with _startup_lock:
+        if _started:
+            return
+        _started = True
+        start_workers()
+        if SYNC_ON_STARTUP:
+            threading.Thread(target=sync_on_startup, daemon=True).start()
+
 
 if __name__ == "__main__":
-    # Initialize database
+    # Development server; use serve.py (or wsgi.py) in production
     print("starting media tracker...")
     initialize_app()
 
-    # Run Flask app
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # Run Flask app (the reloader would import this module again and start a second set of workers)
+    app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False, threaded=True)
@@ -3,6 +3,37 @@ import { Film, Tv, Disc, Search, AlertCircle, RefreshCw, X } from 'lucide-react'
 
 const API_URL = 'http://localhost:5000/api';
 
+// Last ETag seen per URL; unchanged data comes back as a bodiless 304
+const etags = {};
+
+// GET url, returning null if it has not changed since the last call
+const fetchIfChanged = async (url) => {
+  const headers = etags[url] ? { 'If-None-Match': etags[url] } : {};
+  const response = await fetch(url, { headers, cache: 'no-store' });
+  if (response.status === 304) return null;
+  if (!response.ok) throw new Error(`Failed to load ${url}`);
+  const etag = response.headers.get('ETag');
+  if (etag) etags[url] = etag;
+  return response.json();
+};
+
+// Apply a {movies, series, all} genre-count delta; a count of 0 removes the genre
+const applyGenreDelta = (prev, delta) => {
+  const next = { ...prev };
+  Object.entries(delta).forEach(([group, counts]) => {
+    const merged = { ...(next[group] || {}) };
+    Object.entries(counts).forEach(([genre, count]) => {
+      if (count) {
+        merged[genre] = count;
+      } else {
+        delete merged[genre];
+      }
+    });
+    next[group] = merged;
+  });
+  return next;
+};
+
 const MediaTrackerGUI = () => {
   const [stats, setStats] = useState({
     movies: 0,
@@ -23,23 +54,54 @@ const MediaTrackerGUI = () => {
   const [syncing, setSyncing] = useState(false);
   const [error, setError] = useState('');
 
-  // Load stats on mount and set up auto-refresh
+  // Load stats on mount, then follow live updates from the server
   useEffect(() => {
-    loadStats();
-    loadGenreStats();
-    const interval = setInterval(() => {
+    if (!window.EventSource) {
+      // No Server-Sent Events support: fall back to polling
       loadStats();
       loadGenreStats();
-    }, 5000); // Refresh every 5 seconds
-    return () => clearInterval(interval);
+      const interval = setInterval(() => {
+        loadStats();
+        loadGenreStats();
+      }, 5000); // Refresh every 5 seconds
+      return () => clearInterval(interval);
+    }
+    const events = new EventSource(`${API_URL}/events`);
+    events.addEventListener('snapshot', (e) => {
+      // Sent on every (re)connect
+      const data = JSON.parse(e.data);
+      setStats(data.stats);
+      setGenreStats(data.genres);
+    });
+    events.addEventListener('stats', (e) => {
+      const delta = JSON.parse(e.data);
+      setStats(prev => ({ ...prev, ...delta }));
+    });
+    events.addEventListener('genres', (e) => {
+      const delta = JSON.parse(e.data);
+      setGenreStats(prev => applyGenreDelta(prev, delta));
+    });
+    events.addEventListener('scan', (e) => {
+      // Includes scans from the serial port and other tabs
+      const data = JSON.parse(e.data).result;
+      if (data && data.success && data.item) {
+        setLastScanned({
+          title: data.item.title,
+          type: data.item.type,
+          year: data.item.year,
+          timestamp: new Date().toLocaleTimeString(),
+          toggled: data.toggled || false,
+          updated: data.updated || false
+        });
+      }
+    });
+    return () => events.close();
   }, []);
 
   const loadStats = async () => {
     try {
-      const response = await fetch(`${API_URL}/stats`);
-      if (!response.ok) throw new Error('Failed to load stats');
-      const data = await response.json();
-      setStats(data);
+      const data = await fetchIfChanged(`${API_URL}/stats`);
+      if (data) setStats(data);
     } catch (err) {
       console.error('Error loading stats:', err);
     }
@@ -47,10 +109,8 @@ const MediaTrackerGUI = () => {
 
   const loadGenreStats = async () => {
     try {
-      const response = await fetch(`${API_URL}/genre-stats`);
-      if (!response.ok) throw new Error('Failed to load genre stats');
-      const data = await response.json();
-      setGenreStats(data);
+      const data = await fetchIfChanged(`${API_URL}/genre-stats`);
+      if (data) setGenreStats(data);
     } catch (err) {
       console.error('Error loading genre stats:', err);
     }
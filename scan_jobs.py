@@ -0,0 +1,84 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Statuses after which a job no longer changes
+FINAL_STATUSES = ('done', 'error')
+
+
+class ScanJobs:
+    """Runs scan/lookup pipelines in a worker pool and keeps their progress.
+
+    A pipeline is called as fn(steps, *args) and returns (result, http_status).
+    It appends to `steps` as it goes, so pollers see each step the moment it
+    is recorded. The most recent `history` jobs are kept for polling, and
+    listener, if given, is called with every finished job.
+    """
+
+    def __init__(self, workers=4, history=500, listener=None):
+        self.listener = listener
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.history = history
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()  # id -> job record, oldest first
+        self.ids = itertools.count(1)
+
+    def submit(self, kind, fn, *args, on_done=None):
+        """Queue a pipeline run and return its job record"""
+        with self.lock:
+            job = {
+                'id': str(next(self.ids)),
+                'kind': kind,
+                'status': 'queued',
+                'steps': [],
+                'result': None,
+                'http_status': None,
+                'error': None,
+                'created': time.time(),
+                'finished': None,
+            }
+            self.jobs[job['id']] = job
+            self._trim()
+            snapshot = self._snapshot(job)
+        self.pool.submit(self._run, job, fn, args, on_done)
+        return snapshot
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return self._snapshot(job) if job else None
+
+    def _snapshot(self, job):
+        snapshot = dict(job)
+        snapshot['steps'] = list(job['steps'])
+        return snapshot
+
+    def _trim(self):
+        excess = len(self.jobs) - self.history
+        for job_id in list(self.jobs):
+            if excess <= 0:
+                break
+            if self.jobs[job_id]['status'] in FINAL_STATUSES:
+                del self.jobs[job_id]
+                excess -= 1
+
+    def _run(self, job, fn, args, on_done):
+        with self.lock:
+            job['status'] = 'running'
+        try:
+            result, http_status = fn(job['steps'], *args)
+            update = {'status': 'done', 'result': result, 'http_status': http_status}
+        except Exception as e:
+            print(f"Error in {job['kind']} job {job['id']}: {e}")
+            update = {'status': 'error', 'error': str(e), 'http_status': 500}
+        with self.lock:
+            job.update(update, finished=time.time())
+            snapshot = self._snapshot(job)
+        for callback in (on_done, self.listener):
+            if callback is not None:
+                try:
+                    callback(snapshot)
+                except Exception as e:
+                    print(f"Error reporting {job['kind']} job {job['id']}: {e}")
@@ -0,0 +1,42 @@
+"""Production entry point: python serve.py
+
+Serves the app with waitress, a multi-threaded WSGI server that runs on
+Windows and Linux. The library, caches and job queues are shared by all
+threads of this one process, so scale with SERVER_THREADS rather than
+extra processes. Every open /api/events stream holds a thread.
+"""
+import os
+import signal
+import sys
+from waitress import serve
+import media_tracker  # loads .env
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "5000"))
+SERVER_THREADS = int(os.getenv("SERVER_THREADS", "32"))
+TRUSTED_PROXY = os.getenv("TRUSTED_PROXY")  # reverse proxy address, e.g. "127.0.0.1"
+
+
+def exit_on_sigterm(signum, frame):
+    # waitress only stops on Ctrl+C; exit normally on docker/systemd stop so the
+    # atexit hooks flush the library journal, title index and lookup cache
+    sys.exit(0)
+
+
+def main():
+    signal.signal(signal.SIGTERM, exit_on_sigterm)
+    print("starting media tracker...")
+    media_tracker.initialize_app()
+
+    options = {}
+    if TRUSTED_PROXY:
+        options = {
+            'trusted_proxy': TRUSTED_PROXY,
+            'trusted_proxy_headers': {'x-forwarded-for', 'x-forwarded-proto', 'x-forwarded-host'},
+        }
+    print(f"Serving on http://{HOST}:{PORT} with {SERVER_THREADS} threads")
+    serve(media_tracker.app, host=HOST, port=PORT, threads=SERVER_THREADS, **options)
+
+
+if __name__ == "__main__":
+    main()
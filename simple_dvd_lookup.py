@@ -1,141 +1,71 @@
 import requests
-import pandas as pd
 import os
 import re
 import serial
 import time
-from dotenv import load_dotenv
+import atexit
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from library_sync import sync_sources
+from http_client import coalesce
+from lookup_cache import normalize_term
+import config
+from config import (
+    RADARR_URL, SONARR_URL, SERIAL_PORT, SERIAL_BAUDRATE,
+    radarr, sonarr, upcitemdb, LIBRARY_SOURCES
+)
 
 # ================= CONFIG =================
-load_dotenv()
-
-RADARR_URL = os.getenv("RADARR_URL", "http://192.168.1.10:7878")
-RADARR_API_KEY = os.getenv("RADARR_API_KEY")
-
-SONARR_URL = os.getenv("SONARR_URL", "http://192.168.1.10:8989")
-SONARR_API_KEY = os.getenv("SONARR_API_KEY")
+# Shared settings live in config.py; these only apply to the scanner
 
 # TMDB API key for potential future use (currently using Radarr's TMDB integration)
 TMDB_API_KEY = os.getenv("TMDB_API_KEY")
 
-MOVIE_ROOT = os.getenv("MOVIE_ROOT", "/movies")
-TV_ROOT = os.getenv("TV_ROOT", "/tv")
-
-CSV_FILE = "media_library.csv"
-SERIAL_PORT = os.getenv("SERIAL_PORT", None)  # e.g., "COM3" on Windows, "/dev/ttyUSB0" on Linux
-SERIAL_BAUDRATE = int(os.getenv("SERIAL_BAUDRATE", "115200"))
-
-HEADERS_RADARR = {"X-Api-Key": RADARR_API_KEY}
-HEADERS_SONARR = {"X-Api-Key": SONARR_API_KEY}
-
-# =============== HELPERS ==================
-
-def load_or_create_db():
-    if os.path.exists(CSV_FILE):
-        df = pd.read_csv(CSV_FILE)
-        # Ensure proper dtypes for all columns
-        df = df.astype({
-            'type': 'object',
-            'title': 'object',
-            'year': 'object',
-            'tmdb_id': 'object',
-            'tvdb_id': 'object',
-            'season_count': 'object',
-            'has_physical': 'object',
-            'barcode': 'object',
-            'source': 'object'
-        })
-        return df
-    return pd.DataFrame(columns=[
-        "type", "title", "year",
-        "tmdb_id", "tvdb_id",
-        "season_count",
-        "has_physical", "barcode",
-        "source"
-    ])
-
-def save_db(df):
-    df.to_csv(CSV_FILE, index=False)
-
-# ========== IMPORT FROM RADARR ============
-
-def import_radarr(df):
-    r = requests.get(f"{RADARR_URL}/api/v3/movie", headers=HEADERS_RADARR)
-    r.raise_for_status()
-
-    rows = []
-    for m in r.json():
-        if not ((df["title"] == m["title"]) & (df["type"] == "movie")).any():
-            rows.append({
-                "type": "movie",
-                "title": m["title"],
-                "year": m["year"],
-                "tmdb_id": m["tmdbId"],
-                "tvdb_id": None,
-                "season_count": None,
-                "has_physical": False,
-                "barcode": None,
-                "source": "radarr"
-            })
-
-    return pd.concat([df, pd.DataFrame(rows)], ignore_index=True)
-
-# ========== IMPORT FROM SONARR ============
-
-def import_sonarr(df):
-    r = requests.get(f"{SONARR_URL}/api/v3/series", headers=HEADERS_SONARR)
-    r.raise_for_status()
-
-    rows = []
-    for s in r.json():
-        if not ((df["title"] == s["title"]) & (df["type"] == "series")).any():
-            rows.append({
-                "type": "series",
-                "title": s["title"],
-                "year": s["year"],
-                "tmdb_id": None,
-                "tvdb_id": s["tvdbId"],
-                "season_count": len(s["seasons"]),
-                "has_physical": False,
-                "barcode": None,
-                "source": "sonarr"
-            })
-
-    return pd.concat([df, pd.DataFrame(rows)], ignore_index=True)
+MOVIE_SEARCH_WORKERS = int(os.getenv("MOVIE_SEARCH_WORKERS", "4"))  # concurrent Radarr lookups per disc
+
+# Library storage (shared format with media_tracker.py; writes are journaled)
+store = config.open_store()
+sync_state = config.open_sync_state()
+upc_cache = config.open_upc_cache()
+lookup_cache = config.open_lookup_cache()
+atexit.register(lookup_cache.save)
+radarr_metadata, sonarr_metadata = config.arr_metadata()
+search_pool = ThreadPoolExecutor(max_workers=MOVIE_SEARCH_WORKERS)
+add_queue = config.open_add_queue()
 
 # ========== BARCODE LOOKUP ================
 
+@coalesce('upc')
 def lookup_barcode(barcode, max_retries=3):
     """Lookup barcode with retry logic and rate limiting protection"""
+    cached, title = upc_cache.get(barcode)
+    if cached:
+        return title
+
     for attempt in range(max_retries):
         try:
-            r = requests.get(
+            r = upcitemdb.get(
                 "https://api.upcitemdb.com/prod/trial/lookup",
-                params={"upc": barcode},
-                timeout=10
+                params={"upc": barcode}
             )
             data = r.json()
 
             if data.get("code") == "OK" and data.get("items"):
-                return data["items"][0]["title"]
+                title = data["items"][0]["title"]
+                upc_cache.put(barcode, title)
+                return title
 
             # If no items found, no point retrying
             if data.get("code") == "OK" and not data.get("items"):
+                upc_cache.put(barcode, None)
                 return None
             
-            # Handle rate limiting or other errors
+            # Rate limits are waited out by the session's token bucket; if we
+            # still get one here the quota is exhausted
             if data.get("code") != "OK":
                 error_msg = data.get("message", "Unknown error")
-                # If rate limited, wait longer before retrying
                 if "rate" in error_msg.lower() or "limit" in error_msg.lower():
-                    if attempt < max_retries - 1:
-                        wait_time = 5 * (attempt + 1)  # 5s, 10s, 15s for rate limits
-                        print(f"Rate limited (attempt {attempt + 1}/{max_retries}), waiting {wait_time}s...")
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        print(f"Rate limited after {max_retries} attempts. UPCItemDB may have daily limits.")
-                        return None
+                    print(f"Rate limited: {error_msg}. UPCItemDB may have daily limits.")
+                    return None
 
         except (requests.RequestException, ValueError) as e:
             if attempt < max_retries - 1:
@@ -216,28 +146,23 @@ def guess_type(title):
     tv_words = ["season", "complete", "series", "tv"]
     return "series" if any(w in title.lower() for w in tv_words) else "movie"
 
-# ========== GET PROFILES ==================
-
-def get_radarr_quality_profile():
-    """Get the first available quality profile from Radarr"""
-    try:
-        r = requests.get(f"{RADARR_URL}/api/v3/qualityprofile", headers=HEADERS_RADARR)
-        profiles = r.json()
-        return profiles[0]["id"] if profiles else 1
-    except:
-        return 1
-
-def get_sonarr_quality_profile():
-    """Get the first available quality profile from Sonarr"""
-    try:
-        r = requests.get(f"{SONARR_URL}/api/v3/qualityprofile", headers=HEADERS_SONARR)
-        profiles = r.json()
-        return profiles[0]["id"] if profiles else 1
-    except:
-        return 1
-
 # ========== SEARCH TMDB ===================
 
+def lookup_movies(term):
+    """Radarr's TMDB lookup results for one search term (cached)"""
+    results = lookup_cache.get('movie', term)
+    if results is None:
+        r = radarr.get(
+            f"{RADARR_URL}/api/v3/movie/lookup",
+            params={"term": term},
+            timeout=10
+        )
+        r.raise_for_status()
+        results = r.json() or []
+        lookup_cache.put('movie', term, results)
+    return results
+
+@coalesce('radarr/movie/lookup')
 def search_tmdb_movie(title, preferred_year=None):
     """Search for movie using Radarr's TMDB lookup, trying multiple title variations.
     Returns the best match, preferring results that match preferred_year if provided.
@@ -260,26 +185,32 @@ def search_tmdb_movie(title, preferred_year=None):
     if len(filtered_words) < len(words) and len(filtered_words) > 0:
         search_terms.append(' '.join(filtered_words))
     
-    # Collect all results from all search terms
-    for search_term in search_terms:
+    # Query all search terms concurrently
+    futures = {search_pool.submit(lookup_movies, term): i for i, term in enumerate(search_terms)}
+    term_results = [None] * len(search_terms)
+    for future in as_completed(futures):
+        i = futures[future]
         try:
-            r = requests.get(
-                f"{RADARR_URL}/api/v3/movie/lookup",
-                headers=HEADERS_RADARR,
-                params={"term": search_term},
-                timeout=10
-            )
-            r.raise_for_status()
-            results = r.json()
-            if results:
-                # Add results, avoiding duplicates by tmdbId
-                seen_ids = {m.get("tmdbId") for m in all_results}
-                for movie in results:
-                    if movie.get("tmdbId") not in seen_ids:
-                        all_results.append(movie)
-                        seen_ids.add(movie.get("tmdbId"))
+            term_results[i] = future.result()
         except (requests.RequestException, ValueError, KeyError):
             continue
+        # An exact title + year hit on the full title needs no other terms
+        if i == 0 and preferred_year:
+            exact = [m for m in term_results[0]
+                     if m.get("year") == preferred_year
+                     and normalize_term(m.get("title", "")) == normalize_term(title)]
+            if exact:
+                for other in futures:
+                    other.cancel()
+                return max(exact, key=lambda x: x.get("popularity", 0))
+
+    # Merge in search term order, avoiding duplicates by tmdbId
+    seen_ids = set()
+    for results in term_results:
+        for movie in results or []:
+            if movie.get("tmdbId") not in seen_ids:
+                all_results.append(movie)
+                seen_ids.add(movie.get("tmdbId"))
     
     if not all_results:
         return None
@@ -321,72 +252,50 @@ def search_tmdb_movie(title, preferred_year=None):
     
     return selected
 
+@coalesce('sonarr/series/lookup')
 def search_tvdb_series(title):
-    r = requests.get(
-        f"{SONARR_URL}/api/v3/series/lookup",
-        headers=HEADERS_SONARR,
-        params={"term": title}
-    )
-    results = r.json()
+    results = lookup_cache.get('series', title)
+    if results is None:
+        r = sonarr.get(
+            f"{SONARR_URL}/api/v3/series/lookup",
+            params={"term": title}
+        )
+        r.raise_for_status()
+        results = r.json() or []
+        lookup_cache.put('series', title, results)
     return results[0] if results else None
 
 # ========== ADD TO RADARR =================
 
 def add_movie(movie):
+    """Queue a movie for adding to Radarr (submitted in the background)"""
     payload = {
         "tmdbId": movie["tmdbId"],
         "title": movie["title"],
         "year": movie["year"],
-        "qualityProfileId": get_radarr_quality_profile(),
-        "rootFolderPath": MOVIE_ROOT,
+        **radarr_metadata.add_options(),
         "monitored": True,
         "addOptions": {"searchForMovie": False}
     }
-    try:
-        r = requests.post(f"{RADARR_URL}/api/v3/movie", json=payload, headers=HEADERS_RADARR)
-        if r.status_code == 201:
-            print(f"Successfully added to Radarr: {movie['title']}")
-        elif r.status_code == 400:
-            error_msg = r.json()
-            if "MovieExistsValidator" in str(error_msg):
-                print(f"Movie already exists in Radarr: {movie['title']}")
-            else:
-                print(f"Radarr error: {error_msg}")
-        else:
-            print(f"Radarr returned status {r.status_code}: {r.text}")
-    except Exception as e:
-        print(f"Error adding to Radarr: {e}")
+    return add_queue.put('movie', payload)
 
 # ========== ADD TO SONARR =================
 
 def add_series(series):
+    """Queue a series for adding to Sonarr (submitted in the background)"""
     payload = {
         "tvdbId": series["tvdbId"],
         "title": series["title"],
         "year": series["year"],
-        "qualityProfileId": get_sonarr_quality_profile(),
-        "rootFolderPath": TV_ROOT,
+        **sonarr_metadata.add_options(),
         "monitored": True,
         "addOptions": {"searchForMissingEpisodes": False}
     }
-    try:
-        r = requests.post(f"{SONARR_URL}/api/v3/series", json=payload, headers=HEADERS_SONARR)
-        if r.status_code == 201:
-            print(f"Successfully added to Sonarr: {series['title']}")
-        elif r.status_code == 400:
-            error_msg = r.json()
-            if "SeriesExistsValidator" in str(error_msg):
-                print(f"Series already exists in Sonarr: {series['title']}")
-            else:
-                print(f"Sonarr error: {error_msg}")
-        else:
-            print(f"Sonarr returned status {r.status_code}: {r.text}")
-    except Exception as e:
-        print(f"Error adding to Sonarr: {e}")
+    return add_queue.put('series', payload)
 
 # ========== SCAN LOOP =====================
 
-def scan_loop(df):
+def scan_loop(store):
     print(f"Opening serial port {SERIAL_PORT} at {SERIAL_BAUDRATE} baud...")
     try:
         ser = serial.Serial(SERIAL_PORT, SERIAL_BAUDRATE, timeout=1)
@@ -405,7 +314,7 @@ def scan_loop(df):
 
                 print(f"\nReceived barcode: {barcode}")
 
-                if barcode in df["barcode"].values:
+                if store.find_barcode(barcode) is not None:
                     print("Already scanned.")
                     continue
 
@@ -416,12 +325,7 @@ def scan_loop(df):
                     print("  - Rate limiting (free tier has daily limits)")
                     print("  - Network issues")
                     print("  - Try again later or manually add this item")
-                    # Add a small delay to avoid hammering the API
-                    time.sleep(0.5)
                     continue
-                
-                # Small delay between successful lookups to avoid rate limiting
-                time.sleep(0.2)
 
                 print(f"Raw title: {title}")
                 media_type = guess_type(title)
@@ -440,30 +344,28 @@ def scan_loop(df):
                             print(f"Warning: Found movie from {movie.get('year')}, but barcode suggests {extracted_year}")
                         print(f"Selected: {movie.get('title', 'Unknown')}{year_info}")
                         # Check if movie already exists in database
-                        # Convert tmdb_id to string for comparison, handling NaN values
-                        existing = df[(df["type"] == "movie") & (df["tmdb_id"].astype(str).str.replace('.0', '', regex=False) == str(movie["tmdbId"]))]
-                        if not existing.empty:
-                            # Update existing entry with physical copy info
-                            df.loc[existing.index[0], "has_physical"] = True
-                            df.loc[existing.index[0], "barcode"] = barcode
-                            save_db(df)
-                            print(f"Updated existing movie with physical copy info.")
-                        else:
-                            add_movie(movie)
-                            new_row = pd.DataFrame([{
-                                "type": "movie",
-                                "title": movie["title"],
-                                "year": movie["year"],
-                                "tmdb_id": movie["tmdbId"],
-                                "tvdb_id": None,
-                                "season_count": None,
-                                "has_physical": True,
-                                "barcode": barcode,
-                                "source": "barcode"
-                            }])
-                            df = pd.concat([df, new_row], ignore_index=True)
-                            save_db(df)
-                            print("Added & saved.")
+                        # Lookup and write under the lock so a background compaction can't relabel rows in between
+                        with store.lock:
+                            existing = store.find_external("movie", tmdb_id=movie["tmdbId"])
+                            if existing is not None:
+                                # Update existing entry with physical copy info
+                                store.update(existing, {"has_physical": True, "barcode": barcode})
+                                print(f"Updated existing movie with physical copy info.")
+                            else:
+                                store.append([{
+                                    "type": "movie",
+                                    "title": movie["title"],
+                                    "year": movie["year"],
+                                    "tmdb_id": movie["tmdbId"],
+                                    "tvdb_id": None,
+                                    "season_count": None,
+                                    "has_physical": True,
+                                    "barcode": barcode,
+                                    "source": "barcode",
+                                    "genres": ""
+                                }])
+                                add_movie(movie)
+                                print("Saved; queued for Radarr.")
                     else:
                         print("Movie not found in search.")
 
@@ -471,30 +373,27 @@ def scan_loop(df):
                     series = search_tvdb_series(clean_search_title)
                     if series:
                         # Check if series already exists in database
-                        # Convert tvdb_id to string for comparison, handling NaN values
-                        existing = df[(df["type"] == "series") & (df["tvdb_id"].astype(str).str.replace('.0', '', regex=False) == str(series["tvdbId"]))]
-                        if not existing.empty:
-                            # Update existing entry with physical copy info
-                            df.loc[existing.index[0], "has_physical"] = True
-                            df.loc[existing.index[0], "barcode"] = barcode
-                            save_db(df)
-                            print(f"Updated existing series with physical copy info.")
-                        else:
-                            add_series(series)
-                            new_row = pd.DataFrame([{
-                                "type": "series",
-                                "title": series["title"],
-                                "year": series["year"],
-                                "tmdb_id": None,
-                                "tvdb_id": series["tvdbId"],
-                                "season_count": len(series["seasons"]),
-                                "has_physical": True,
-                                "barcode": barcode,
-                                "source": "barcode"
-                            }])
-                            df = pd.concat([df, new_row], ignore_index=True)
-                            save_db(df)
-                            print("Added & saved.")
+                        with store.lock:
+                            existing = store.find_external("series", tvdb_id=series["tvdbId"])
+                            if existing is not None:
+                                # Update existing entry with physical copy info
+                                store.update(existing, {"has_physical": True, "barcode": barcode})
+                                print(f"Updated existing series with physical copy info.")
+                            else:
+                                store.append([{
+                                    "type": "series",
+                                    "title": series["title"],
+                                    "year": series["year"],
+                                    "tmdb_id": None,
+                                    "tvdb_id": series["tvdbId"],
+                                    "season_count": len(series["seasons"]),
+                                    "has_physical": True,
+                                    "barcode": barcode,
+                                    "source": "barcode",
+                                    "genres": ""
+                                }])
+                                add_series(series)
+                                print("Saved; queued for Sonarr.")
                     else:
                         print("Series not found in search.")
 
@@ -502,18 +401,23 @@ def scan_loop(df):
         print("\nExiting...")
     finally:
         ser.close()
+        print("Waiting for queued adds to finish...")
+        if not add_queue.wait(timeout=60):
+            print("Gave up waiting; these titles were not added to Radarr/Sonarr:")
+            for item in add_queue.unfinished():
+                print(f"  {item['type']} \"{item['title']}\" ({item['status']})")
+        store.close()
         print("Serial port closed.")
 
 # ================= MAIN ===================
 
 def main():
-    df = load_or_create_db()
-    df = import_radarr(df)
-    df = import_sonarr(df)
-    save_db(df)
+    radarr_metadata.start()
+    sonarr_metadata.start()
+    sync_sources(store, sync_state, LIBRARY_SOURCES)
 
-    print(f"Loaded {len(df)} items.")
-    scan_loop(df)
+    print(f"Loaded {len(store.frame())} items.")
+    scan_loop(store)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,200 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from rapidfuzz import fuzz, process
+
+# A title is only scored if it shares at least this fraction of trigrams
+# with the query (relative to whichever of the two has fewer trigrams)
+MIN_SHARED_TRIGRAMS = 0.3
+
+INDEX_FORMAT = 1
+
+
+def normalize_title(title):
+    """Lowercased title used for fuzzy matching ('' for missing titles)"""
+    if title is None or (not isinstance(title, str) and pd.isna(title)):
+        return ""
+    return str(title).lower()
+
+def trigrams(text):
+    """Set of padded character trigrams of a normalized title"""
+    if not text:
+        return set()
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def library_fingerprint(df):
+    """Hash of the columns the index depends on, used to validate a saved index"""
+    if df.empty:
+        return 0
+    return int(pd.util.hash_pandas_object(df[['type', 'title', 'year']].astype(str), index=True).sum())
+
+
+class TitleIndex:
+    """Inverted trigram index over normalized library titles.
+
+    Only titles that share enough trigrams with the query are passed to the
+    batched fuzzy scorer. Rows can be added and removed incrementally, and the
+    index can be saved next to the library so startup does not rebuild it.
+    """
+
+    def __init__(self):
+        self.labels = []
+        self.titles = []
+        self.types = []
+        self.years = []
+        self.gram_counts = []
+        self.postings = {}
+        self._positions = {}
+        self._arrays = {}
+        self._columns = None
+
+    @classmethod
+    def build(cls, df):
+        index = cls()
+        index.add(df)
+        return index
+
+    # ---------- maintenance ----------
+
+    def add(self, df):
+        """Index the rows of df (labels must not already be indexed)"""
+        years = pd.to_numeric(df['year'], errors='coerce')
+        for label, title, media_type, year in zip(df.index, df['title'], df['type'], years):
+            position = len(self.labels)
+            text = normalize_title(title)
+            grams = trigrams(text)
+            self.labels.append(label)
+            self.titles.append(text)
+            self.types.append(media_type)
+            self.years.append(float(year))
+            self.gram_counts.append(len(grams))
+            self._positions[label] = position
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(position)
+                self._arrays.pop(gram, None)
+        self._columns = None
+
+    def remove(self, label):
+        """Drop a row from the index"""
+        position = self._positions.pop(label, None)
+        if position is None:
+            return
+        for gram in trigrams(self.titles[position]):
+            self.postings[gram].remove(position)
+            self._arrays.pop(gram, None)
+        self.titles[position] = ""
+        self.types[position] = None
+        self.gram_counts[position] = 0
+        self._columns = None
+
+    def replace(self, df):
+        """Re-index rows whose title, type or year changed"""
+        for label in df.index:
+            self.remove(label)
+        self.add(df)
+
+    def relabel(self, mapping):
+        """Rename row labels (old -> new), e.g. after the library index is reset"""
+        self.labels = [mapping.get(label, label) for label in self.labels]
+        self._positions = {mapping.get(label, label): pos for label, pos in self._positions.items()}
+
+    # ---------- querying ----------
+
+    def _posting_array(self, gram):
+        array = self._arrays.get(gram)
+        if array is None:
+            array = self._arrays[gram] = np.array(self.postings[gram], dtype=np.int64)
+        return array
+
+    def _column_arrays(self):
+        if self._columns is None:
+            self._columns = (
+                np.array(self.types, dtype=object),
+                np.array(self.years, dtype=float),
+                np.array(self.gram_counts, dtype=np.int64),
+            )
+        return self._columns
+
+    def match(self, query, media_type=None, year=None, limit=10):
+        """Return [(label, similarity)] for titles similar to the normalized query, best first.
+
+        A title matches if similarity >= 80, or >= 60 when one title contains
+        the other. When year is given, rows more than 2 years off are dropped.
+        """
+        query_grams = trigrams(query)
+        grams = [g for g in query_grams if g in self.postings]
+        if not grams:
+            return []
+
+        types, years, gram_counts = self._column_arrays()
+        shared = np.bincount(
+            np.concatenate([self._posting_array(g) for g in grams]),
+            minlength=len(self.labels)
+        )
+        needed = np.maximum(1, np.ceil(MIN_SHARED_TRIGRAMS * np.minimum(len(query_grams), gram_counts)))
+        mask = shared >= needed
+        if media_type:
+            mask &= types == media_type
+        if year:
+            # Rows without a year are kept (allow 2 year difference)
+            mask &= np.isnan(years) | (np.abs(years - int(year)) <= 2)
+
+        candidates = np.flatnonzero(mask)
+        if not len(candidates):
+            return []
+
+        scores = process.cdist(
+            [query], [self.titles[i] for i in candidates],
+            scorer=fuzz.ratio, score_cutoff=60, workers=-1
+        )[0]
+        order = np.argsort(-scores, kind='stable')
+
+        matches = []
+        for i in order:
+            similarity = float(scores[i])
+            if similarity < 60:
+                break
+            title = self.titles[candidates[i]]
+            if similarity >= 80 or query in title or title in query:
+                matches.append((self.labels[candidates[i]], similarity))
+                if len(matches) == limit:
+                    break
+        return matches
+
+    # ---------- persistence ----------
+
+    def save(self, path, fingerprint):
+        """Write the index atomically to path, tagged with the library fingerprint"""
+        state = {
+            'format': INDEX_FORMAT,
+            'fingerprint': fingerprint,
+            'labels': self.labels,
+            'titles': self.titles,
+            'types': self.types,
+            'years': self.years,
+            'gram_counts': self.gram_counts,
+            'postings': self.postings,
+            'positions': self._positions,
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, fingerprint):
+        """Load a saved index, or return None if it is missing or out of date"""
+        try:
+            with open(path, 'rb') as f:
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if state.get('format') != INDEX_FORMAT or state.get('fingerprint') != fingerprint:
+            return None
+        index = cls()
+        for name in ('labels', 'titles', 'types', 'years', 'gram_counts', 'postings'):
+            setattr(index, name, state[name])
+        index._positions = state['positions']
+        return index
@@ -0,0 +1,69 @@
+import sqlite3
+import threading
+import time
+
+
+class UpcCache:
+    """On-disk barcode -> title cache shared by the web app and the CLI scanner.
+
+    Found titles and "not in UPCItemDB" results are cached with separate TTLs,
+    so repeat scans and known-missing barcodes don't spend the daily quota.
+    Lookups that failed (rate limits, network errors) are never cached.
+    """
+
+    def __init__(self, path, hit_ttl=90 * 86400, miss_ttl=86400):
+        self.path = path
+        self.hit_ttl = hit_ttl
+        self.miss_ttl = miss_ttl
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        # SQLite handles locking between the web app and CLI processes
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS upc (
+                barcode TEXT PRIMARY KEY,
+                title TEXT,
+                fetched_at REAL NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    def get(self, barcode):
+        """Return (cached, title). title is None for a cached not-found result."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT title, fetched_at FROM upc WHERE barcode = ?", (barcode,)
+            ).fetchone()
+            if row is not None:
+                title, fetched_at = row
+                ttl = self.hit_ttl if title is not None else self.miss_ttl
+                if time.time() - fetched_at < ttl:
+                    if title is None:
+                        self.negative_hits += 1
+                    else:
+                        self.hits += 1
+                    return True, title
+            self.misses += 1
+            return False, None
+
+    def put(self, barcode, title):
+        """Record a lookup result (title=None means UPCItemDB has no such barcode)"""
+        with self.lock:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO upc (barcode, title, fetched_at) VALUES (?, ?, ?)",
+                    (barcode, title, time.time())
+                )
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM upc").fetchone()[0]
+            return {
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'entries': entries,
+            }
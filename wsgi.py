@@ -0,0 +1,8 @@
+"""WSGI entry point for other servers, e.g. gunicorn -w 1 --threads 32 wsgi:app
+
+Run a single worker process: the library, caches, job queues and the serial
+port reader live in this process and must not be duplicated.
+"""
+from media_tracker import app, initialize_app
+
+initialize_app()